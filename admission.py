@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Tuple
+
+from metrics import Counters, LatencyRecorder
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (queue full or waited too long)."""
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the number of agent turns in flight, globally and per key (conversation or sender).
+
+    Requests that cannot start immediately wait in a bounded FIFO queue. Requests are
+    rejected straight away when the queue (or the key's share of it) is full, and after
+    `max_wait` seconds in the queue, so overload shows up as fast "busy" responses
+    instead of ever-growing latency for everyone.
+
+    Must be used from a single event loop.
+    """
+    def __init__(self, max_in_flight: int = 8, max_per_key: int = 1, max_queue: int = 32,
+                 max_queue_per_key: int = 2, max_wait: float = 10.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_per_key = max(1, max_per_key)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_key = max(0, max_queue_per_key)
+        self.max_wait = max_wait
+
+        self._in_flight = 0
+        self._in_flight_by_key: Dict[str, int] = {}
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        self._queued_by_key: Dict[str, int] = {}
+
+        self.queue_wait = LatencyRecorder()
+        self.counters = Counters("admitted", "queued", "rejected_queue_full", "rejected_key_queue_full",
+                                 "rejected_timeout", "rejected_no_capacity")
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8")),
+            max_per_key=int(os.getenv("ADMISSION_MAX_PER_KEY", "1")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32")),
+            max_queue_per_key=int(os.getenv("ADMISSION_MAX_QUEUE_PER_KEY", "2")),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10")),
+        )
+
+    def _has_capacity(self, key: str) -> bool:
+        return self._in_flight < self.max_in_flight and self._in_flight_by_key.get(key, 0) < self.max_per_key
+
+    def _take_slot(self, key: str) -> None:
+        self._in_flight += 1
+        self._in_flight_by_key[key] = self._in_flight_by_key.get(key, 0) + 1
+
+    def _dequeue(self, key: str, future: asyncio.Future) -> None:
+        try:
+            self._waiters.remove((key, future))
+        except ValueError:
+            return
+        self._queued_by_key[key] -= 1
+        if not self._queued_by_key[key]:
+            del self._queued_by_key[key]
+
+    def _release(self, key: str) -> None:
+        self._in_flight -= 1
+        self._in_flight_by_key[key] -= 1
+        if not self._in_flight_by_key[key]:
+            del self._in_flight_by_key[key]
+
+        # Hand freed capacity to the oldest waiters that can use it. The slot is taken on
+        # their behalf before waking them, so a newly arriving request cannot steal it.
+        for waiter_key, future in list(self._waiters):
+            if self._in_flight >= self.max_in_flight:
+                break
+            if future.done() or not self._has_capacity(waiter_key):
+                continue
+            self._dequeue(waiter_key, future)
+            self._take_slot(waiter_key)
+            future.set_result(None)
+
+    def _retry_after(self) -> float:
+        p50 = self.queue_wait.percentile(50)
+        return max(1.0, round(p50 or self.max_wait / 2))
+
+    async def acquire(self, key: str, queue: bool = True) -> None:
+        """
+        Wait for an in-flight slot for `key`.
+
+        Args:
+            key: The conversation, sender or other unit that is limited to `max_per_key` slots
+            queue: Whether to wait in the queue when there is no capacity right now. Background
+                work (bulk runs) passes False so that it never takes queue places from users.
+
+        Raises:
+            AdmissionRejected: If the queue is full, the wait exceeded `max_wait`, or there
+                is no capacity and `queue` is False
+        """
+        # Waiters are only ever blocked by the global or their own key's limit, and capacity is
+        # handed to them on release, so a request that fits now is not overtaking anyone
+        if self._has_capacity(key):
+            self._take_slot(key)
+            self.counters.inc("admitted")
+            self.queue_wait.record(0.0)
+            return
+
+        if not queue:
+            self.counters.inc("rejected_no_capacity")
+            raise AdmissionRejected("no_capacity", self._retry_after())
+        if len(self._waiters) >= self.max_queue:
+            self.counters.inc("rejected_queue_full")
+            raise AdmissionRejected("queue_full", self._retry_after())
+        if self._queued_by_key.get(key, 0) >= self.max_queue_per_key:
+            self.counters.inc("rejected_key_queue_full")
+            raise AdmissionRejected("too_many_pending_requests", self._retry_after())
+
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((key, future))
+        self._queued_by_key[key] = self._queued_by_key.get(key, 0) + 1
+        self.counters.inc("queued")
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted at the last moment - keep the slot
+                pass
+            else:
+                future.cancel()
+                self._dequeue(key, future)
+                self.counters.inc("rejected_timeout")
+                self.queue_wait.record(time.monotonic() - started)
+                raise AdmissionRejected("queue_timeout", self._retry_after())
+        except asyncio.CancelledError:
+            # Caller went away: give the slot back if it was granted, otherwise leave the queue
+            if future.done() and not future.cancelled():
+                self._release(key)
+            else:
+                future.cancel()
+                self._dequeue(key, future)
+            raise
+
+        self.queue_wait.record(time.monotonic() - started)
+        self.counters.inc("admitted")
+
+    @asynccontextmanager
+    async def admit(self, key: str, queue: bool = True) -> AsyncIterator[None]:
+        """Hold an in-flight slot for `key` for the duration of the block."""
+        await self.acquire(key, queue)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Metrics for the /api/metrics endpoint."""
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "queue_wait": self.queue_wait.snapshot(),
+            "counters": self.counters.snapshot(),
+        }
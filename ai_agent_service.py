@@ -1,23 +1,44 @@
 from custom_agents import Agent, Runner
-from typing import List, Dict, Any
+from llm_resilience import LLMUnavailableError
+from typing import List, Dict, Any, Optional, Tuple
 import json
 import os
-from dotenv import load_dotenv
-import openai
-import asyncio
-import nest_asyncio
 import re
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
 
-load_dotenv()
+_JSON_BLOCK = re.compile(r"```json\s*(.*?)```", re.DOTALL)
+
+
+def extract_specifications(text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Pull every ```json specification block out of an agent reply.
+
+    A block may hold one specification object or an array of them. Blocks that are not
+    valid JSON are left in the text.
+
+    Returns:
+        The reply with the parsed blocks removed, and the specifications in order
+    """
+    specifications = []
+
+    def take(match: "re.Match") -> str:
+        try:
+            parsed = json.loads(match.group(1).strip())
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON: {e}")
+            return match.group(0)
+        parsed_items = parsed if isinstance(parsed, list) else [parsed]
+        specifications.extend(item for item in parsed_items if isinstance(item, dict))
+        return ""
+
+    message = _JSON_BLOCK.sub(take, text)
+    if not specifications:
+        return text, []
+    return re.sub(r"\n{3,}", "\n\n", message).strip(), specifications
+
 
 class ProcurementAgent:
     def __init__(self):
-        # Initialize OpenAI client
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        
         self.agent = Agent(
             name="Procurement Assistant",
             instructions="""You are a helpful AI procurement assistant. Your goal is to help users specify products they want to purchase. 
@@ -41,6 +62,10 @@ class ProcurementAgent:
                ```
             6. The JSON must be enclosed in triple backticks with "json" exactly as shown above
             7. Before the JSON, summarize the specification in natural language
+            8. Users may want several different products in one conversation (e.g. "I need 20 Pyrus calleryana, 5 pallets of compost and a wheelbarrow").
+               Treat each product as a separate line item, keep track of the details of each one, and ask about the items that still need details.
+               Each line item is finalized on its own: as soon as an item is fully specified, output its JSON specification, even if other items are still open.
+               Output one separate ```json block per finalized item, and never combine several products into one specification.
             
             Example conversation flow:
             User: "I want to buy an iPhone 15 Pro, 256GB, black"
@@ -67,52 +92,35 @@ class ProcurementAgent:
             When a user asks "give me the specs" or similar, always provide a full specification, including the formatted JSON.
             """
         )
-        # Initialize chat history with system message
-        self.chat_history = [
-            {
-                "role": "system",
-                "content": self.agent.instructions
-            }
-        ]
-        self.current_product = {
-            "name": None,
-            "specifications": {}
-        }
+        # Conversation state (history, extracted product details) is passed in and returned
+        # per call: one agent instance serves all conversations concurrently
 
-    def process_message(self, user_message: str, history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+    async def process_message(self, user_message: str, history: List[Dict[str, str]] = None, force_finalize: bool = False,
+                              finalized_items: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Args:
+            user_message: The message to answer
+            history: The conversation so far (not modified; a new list is returned)
+            force_finalize: Finalize right away without follow-up questions (bulk processing)
+            finalized_items: Names of the line items already finalized in this conversation
+
+        Returns:
+            A dict with "success", "message" (the reply without JSON blocks), "specifications"
+            (every specification finalized in this reply), "specification" (the first of them,
+            or None), "history" and "usage"
+        """
+        chat_history = list(history or [])
         try:
             # Debug logging
             print(f"Processing message: {user_message}")
             print(f"History length: {len(history) if history else 0}")
             
-            # Important: If external history is provided, use it to initialize our chat_history
-            # This ensures we maintain continuity across different sessions
-            if history and len(history) > 0:
-                # Ensure system message is always first
-                system_message = next((msg for msg in history if msg["role"] == "system"), None)
-                if not system_message:
-                    history = [{"role": "system", "content": self.agent.instructions}] + history
-                
-                # Use the provided history to replace our chat_history
-                self.chat_history = history.copy()
-                print(f"Updated chat_history with provided history ({len(history)} messages)")
-                
-                # Try to extract product details from history
-                self._extract_product_from_history(self.chat_history)
-                print(f"Extracted product details: {self.current_product}")
-            else:
-                # Ensure we have a system message at the beginning
-                if not self.chat_history or len(self.chat_history) == 0:
-                    self.chat_history = [{"role": "system", "content": self.agent.instructions}]
-                elif self.chat_history[0]["role"] != "system":
-                    self.chat_history = [{"role": "system", "content": self.agent.instructions}] + self.chat_history
+            # Ensure the system message is always first
+            if not any(msg["role"] == "system" for msg in chat_history):
+                chat_history.insert(0, {"role": "system", "content": self.agent.instructions})
 
-            # Always append the new user message to the chat history
-            self.chat_history.append({
-                "role": "user",
-                "content": user_message
-            })
-            print(f"Added user message to chat_history. New length: {len(self.chat_history)}")
+            # Try to extract product details from history
+            product = self._extract_product_from_history(chat_history)
 
             # Special trigger for finalizing specification 
             finalize_triggers = ["that's all", "no, thank you", "nothing else", "that is all", "that should be it", "no thank", "thats all"]
@@ -122,102 +130,95 @@ class ProcurementAgent:
             memory_triggers = ["remember", "what did i", "what was the", "specified earlier", "what product", "give me the spec", "specs again"]
             should_remember = any(trigger in user_message.lower() for trigger in memory_triggers)
             
-            # Create a new event loop for this thread if needed
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-            # Prepare context with additional instructions and FULL chat history
-            context = {"chat_history": self.chat_history}
-            print(f"Sending chat_history with {len(self.chat_history)} messages to agent")
+            # Prepare context with additional instructions and FULL chat history.
+            # The user message is passed separately and only added to the history once answered.
+            context = {"chat_history": chat_history}
+            print(f"Sending chat_history with {len(chat_history)} messages to agent")
             
             # If we have product info, include it in instructions
-            product_summary = self._get_product_summary()
+            product_summary = self._get_product_summary(product)
             context["instructions"] = f"Remember, the user has previously mentioned: {product_summary}"
             
             if should_finalize or "give me the specification" in user_message.lower():
                 finalize_instruction = f"The user has indicated they're done specifying the product or wants a specification. You must output a finalized JSON specification using the exact format specified in your instructions. Based on the conversation, they want: {product_summary}"
                 context["instructions"] = finalize_instruction
             
+            if force_finalize:
+                # Used for non-interactive callers (e.g. bulk processing) where there is no chance to ask follow-up questions
+                force_instruction = "There will be no follow-up conversation. You must output a finalized JSON specification for the item described in the user's message right now, using the exact format specified in your instructions. Do not ask questions; make reasonable assumptions for any details that are not specified."
+                context["instructions"] = force_instruction
+            
             if should_remember:
                 remember_instruction = f"The user is asking you to recall what they specified previously. Make sure to mention ALL details they've provided so far AND provide a JSON specification. Based on the conversation history, they have mentioned: {product_summary}"
                 context["instructions"] = remember_instruction
+
+            if finalized_items:
+                context["instructions"] += f"\nLine items already finalized in this conversation: {', '.join(finalized_items)}. Only output their JSON specification again if the user changes them or asks for it."
                 
             # Run the agent with FULL chat history context
-            result = loop.run_until_complete(Runner.run(
-                self.agent, 
+            result = await Runner.run(
+                self.agent,
                 user_message,
                 context=context
-            ))
-            
-            # Always append assistant's response to chat history
-            self.chat_history.append({
-                "role": "assistant",
-                "content": result.final_output
-            })
-            print(f"Added assistant response to chat_history. Final length: {len(self.chat_history)}")
+            )
 
-            # Check if the response contains a JSON specification
-            if "```json" in result.final_output:
-                try:
-                    # Extract JSON part
-                    json_str = result.final_output.split("```json")[1].split("```")[0].strip()
-                    specification = json.loads(json_str)
-                    return {
-                        "success": True,
-                        "message": result.final_output.split("```json")[0].strip(),
-                        "specification": specification,
-                        "history": self.chat_history  # Return the COMPLETE updated history
-                    }
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing JSON: {e}")
-                    return {
-                        "success": True,
-                        "message": result.final_output,
-                        "specification": None,
-                        "history": self.chat_history  # Return the COMPLETE updated history
-                    }
-            
-            # Always return the complete chat history
+            # Append the answered turn to chat history
+            chat_history = chat_history + [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": result.final_output},
+            ]
+            print(f"Added user message and assistant response to chat_history. Final length: {len(chat_history)}")
+            usage = result.usage.to_dict()
+
+            # A reply may finalize several line items, one ```json block each
+            message, specifications = extract_specifications(result.final_output)
             return {
                 "success": True,
-                "message": result.final_output,
-                "specification": None,
-                "history": self.chat_history  # Return the COMPLETE updated history
+                "message": message,
+                "specifications": specifications,
+                "specification": specifications[0] if specifications else None,
+                "history": chat_history,  # Return the COMPLETE updated history
+                "usage": usage
             }
         except Exception as e:
             print(f"Error in process_message: {e}")
             return {
                 "success": False,
                 "message": f"An error occurred: {str(e)}",
+                "specifications": [],
                 "specification": None,
-                "history": self.chat_history  # Return the COMPLETE updated history even on error
+                "history": chat_history,  # Return the history unchanged on error
+                "usage": None,
+                "upstream_unavailable": isinstance(e, LLMUnavailableError)
             }
     
-    def _extract_product_from_history(self, history: List[Dict[str, str]]) -> None:
+    def _extract_product_from_history(self, history: List[Dict[str, str]]) -> Dict[str, Any]:
         """Extract product details from conversation history"""
+        product = {
+            "name": None,
+            "specifications": {}
+        }
         user_messages = [msg["content"] for msg in history if msg["role"] == "user"]
         assistant_messages = [msg["content"] for msg in history if msg["role"] == "assistant"]
         
         # First pass: look for explicit product mentions
-        self._extract_explicit_products(user_messages)
+        self._extract_explicit_products(user_messages, product)
         
         # If no products found, try more sophisticated methods
-        if not self.current_product["name"]:
-            self._extract_from_patterns(user_messages)
+        if not product["name"]:
+            self._extract_from_patterns(user_messages, product)
         
         # If still no product, look in assistant messages for confirmations
-        if not self.current_product["name"]:
-            self._extract_from_assistant_messages(assistant_messages)
+        if not product["name"]:
+            self._extract_from_assistant_messages(assistant_messages, product)
         
         # Extract specifications regardless of product name
-        self._extract_specifications(user_messages)
+        self._extract_specifications(user_messages, product)
         
-        print(f"Extracted product: {self.current_product}")
+        print(f"Extracted product: {product}")
+        return product
     
-    def _extract_explicit_products(self, messages: List[str]) -> None:
+    def _extract_explicit_products(self, messages: List[str], product: Dict[str, Any]) -> None:
         """Extract explicitly mentioned products"""
         product_keywords = ["buy", "purchase", "looking for", "interested in", "want to get", "but a"]
         
@@ -233,16 +234,16 @@ class ProcurementAgent:
                         # Look for capitalized words which might be product names
                         potential_products = re.findall(r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)', msg)
                         if potential_products:
-                            for product in potential_products:
-                                if len(product) > 2 and product.lower() in text_after.lower():
-                                    self.current_product["name"] = product
+                            for candidate in potential_products:
+                                if len(candidate) > 2 and candidate.lower() in text_after.lower():
+                                    product["name"] = candidate
                                     return
                         
                         # Check for ":" which often indicates a product specification
                         if ":" in text_after:
                             product_part = text_after.split(":", 1)[1].strip()
                             if product_part:
-                                self.current_product["name"] = product_part
+                                product["name"] = product_part
                                 return
                         
                         # Otherwise use the text after the keyword
@@ -250,25 +251,25 @@ class ProcurementAgent:
                             # Look for the first substantive word or phrase
                             words = text_after.split()
                             if words and len(words[0]) > 2:
-                                self.current_product["name"] = words[0]
+                                product["name"] = words[0]
                                 if len(words) > 1 and words[1].lower() not in ["a", "an", "the", "of", "for", "with"]:
-                                    self.current_product["name"] += " " + words[1]
+                                    product["name"] += " " + words[1]
                             else:
-                                self.current_product["name"] = text_after[:30]  # Limit length
+                                product["name"] = text_after[:30]  # Limit length
     
-    def _extract_from_patterns(self, messages: List[str]) -> None:
+    def _extract_from_patterns(self, messages: List[str], product: Dict[str, Any]) -> None:
         """Extract product from common patterns in messages"""
         for msg in messages:
             # Look for common phrases
             plant_match = re.search(r'([A-Z][a-z]+ [a-z]+)', msg)
             if plant_match:
-                self.current_product["name"] = plant_match.group(1)
+                product["name"] = plant_match.group(1)
                 return
             
             # Look for quoted product names
             quote_match = re.search(r'"([^"]+)"', msg)
             if quote_match:
-                self.current_product["name"] = quote_match.group(1)
+                product["name"] = quote_match.group(1)
                 return
             
             # Look for detailed specifications which might indicate a product
@@ -277,10 +278,10 @@ class ProcurementAgent:
                 potential_product = re.sub(r'\d+[cm|mm|inches|"]\s*(?:height|width|tall|long)', '', msg, flags=re.IGNORECASE)
                 potential_product = potential_product.strip().strip(',.!?:;')
                 if potential_product and len(potential_product) > 2:
-                    self.current_product["name"] = potential_product
+                    product["name"] = potential_product
                     return
     
-    def _extract_from_assistant_messages(self, messages: List[str]) -> None:
+    def _extract_from_assistant_messages(self, messages: List[str], product: Dict[str, Any]) -> None:
         """Extract product mentions from assistant messages"""
         # Look in assistant confirmations
         for msg in messages:
@@ -296,16 +297,16 @@ class ProcurementAgent:
             for pattern in confirmation_patterns:
                 match = re.search(pattern, msg, re.IGNORECASE)
                 if match:
-                    self.current_product["name"] = match.group(1).strip()
+                    product["name"] = match.group(1).strip()
                     return
             
             # Look for product mentions in parentheses (common for scientific names)
             paren_match = re.search(r'\(([^)]+)\)', msg)
             if paren_match:
-                self.current_product["name"] = paren_match.group(1).strip()
+                product["name"] = paren_match.group(1).strip()
                 return
 
-    def _extract_specifications(self, messages: List[str]) -> None:
+    def _extract_specifications(self, messages: List[str], product: Dict[str, Any]) -> None:
         """Extract specifications from user messages"""
         # Common specification types
         spec_patterns = {
@@ -320,15 +321,15 @@ class ProcurementAgent:
             for spec_type, pattern in spec_patterns.items():
                 matches = re.findall(pattern, msg, re.IGNORECASE)
                 if matches:
-                    if spec_type not in self.current_product["specifications"]:
-                        self.current_product["specifications"][spec_type] = []
+                    if spec_type not in product["specifications"]:
+                        product["specifications"][spec_type] = []
                     
                     for match in matches:
                         if isinstance(match, tuple):  # Some regex patterns return tuples
                             match = " ".join(match).strip()
                         
-                        if match and match not in self.current_product["specifications"][spec_type]:
-                            self.current_product["specifications"][spec_type].append(match)
+                        if match and match not in product["specifications"][spec_type]:
+                            product["specifications"][spec_type].append(match)
             
             # Look for key-value pairs (e.g., "height: 90-120cm")
             kv_matches = re.findall(r'([a-zA-Z]+):\s*([^.,!?]+)', msg)
@@ -336,24 +337,24 @@ class ProcurementAgent:
                 key = key.lower().strip()
                 value = value.strip()
                 
-                if key not in self.current_product["specifications"]:
-                    self.current_product["specifications"][key] = []
+                if key not in product["specifications"]:
+                    product["specifications"][key] = []
                 
-                if value and value not in self.current_product["specifications"][key]:
-                    self.current_product["specifications"][key].append(value)
+                if value and value not in product["specifications"][key]:
+                    product["specifications"][key].append(value)
     
-    def _get_product_summary(self) -> str:
+    def _get_product_summary(self, product: Dict[str, Any]) -> str:
         """Get a summary of the current product and its specifications"""
-        if not self.current_product["name"]:
+        if not product["name"]:
             return "No product specified yet."
         
-        summary = f"Product: {self.current_product['name']}"
+        summary = f"Product: {product['name']}"
         
-        if self.current_product["specifications"]:
+        if product["specifications"]:
             summary += ". Specifications: "
             specs = []
             
-            for spec_type, values in self.current_product["specifications"].items():
+            for spec_type, values in product["specifications"].items():
                 if values:
                     spec_str = f"{spec_type}: {', '.join(values)}"
                     specs.append(spec_str)
@@ -362,10 +363,10 @@ class ProcurementAgent:
         
         return summary
     
-    def _try_extract_from_conversation(self) -> str:
+    def _try_extract_from_conversation(self, history: List[Dict[str, str]]) -> str:
         """Try to extract product information from the conversation as a fallback"""
         important_words = []
-        for msg in self.chat_history:
+        for msg in history:
             if msg["role"] == "user":
                 # Extract capitalized words which might be product names
                 words = msg["content"].split()
@@ -0,0 +1,152 @@
+"""
+Cold start benchmark for the backend.
+
+Measures, in fresh interpreters:
+  - import time of the `server` module
+  - time-to-first-response: from launching uvicorn until the first HTTP response
+  - time-to-first-chat: from launching uvicorn until the first /api/chat turn has been
+    answered. OpenAI is replaced by a local stub, so this covers everything the server
+    loads and does for a real turn (including the openai client) but no upstream latency.
+
+Usage (from the repository root):
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --importtime   # also list the slowest imports
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cheap request that needs no credentials; any response (404 here) counts as "serving"
+PROBE_PATH = "/api/conversations/cold-start-probe"
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+class _StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers every chat completion request immediately with a fixed reply."""
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = json.dumps({
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Could you specify the size of the Pyrus calleryana?"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 900, "completion_tokens": 12, "total_tokens": 912},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_openai() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure_first_responses(stub_url: str, timeout: float = 30.0) -> tuple:
+    """Returns (seconds to the first HTTP response, seconds to the first answered chat turn)."""
+    port = _free_port()
+    env = dict(os.environ, OPENAI_API_KEY="benchmark", OPENAI_BASE_URL=stub_url, OFFER_INDEX_PATH="")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        while True:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"No response within {timeout}s")
+            try:
+                httpx.get(base_url + PROBE_PATH, timeout=1.0)
+                break
+            except httpx.TransportError:
+                if process.poll() is not None:
+                    raise RuntimeError("uvicorn exited before serving a request")
+                time.sleep(0.01)
+        first_response = time.perf_counter() - started
+
+        response = httpx.post(base_url + "/api/chat", json={"message": "I want to buy Pyrus calleryana"}, timeout=timeout)
+        response.raise_for_status()
+        return first_response, time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def slowest_imports(limit: int = 15) -> list:
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(cum / 1000, 1), "self_ms": round(own / 1000, 1)} for cum, own, name in rows[:limit]]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="Also report the slowest imports")
+    args = parser.parse_args()
+
+    stub = start_stub_openai()
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    responses = [measure_first_responses(stub_url) for _ in range(args.runs)]
+    stub.shutdown()
+
+    report = {
+        "import_server": summarize([measure_import() for _ in range(args.runs)]),
+        "time_to_first_response": summarize([first for first, _ in responses]),
+        "time_to_first_chat": summarize([chat for _, chat in responses]),
+    }
+    if args.importtime:
+        report["slowest_imports"] = slowest_imports()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+CPU time and bytes on the wire for /api/chat-style responses of long conversations.
+
+Compares:
+  - fastapi:   jsonable_encoder + json.dumps (what FastAPI does for a returned dict)
+  - orjson:    the fast encoder used by responses.json_response
+  - +model:    validation against ChatResponse before encoding (what /api/chat does)
+  - +gzip/+br: validation and orjson followed by compression (br only if brotli is installed)
+  - snapshot:  a repeated GET /api/conversations/{id} served from SnapshotCache
+
+Usage (from the repository root):
+    python benchmarks/response_serialization.py --iterations 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import responses  # noqa: E402
+
+CONVERSATION_LENGTHS = [20, 200, 1000]
+
+
+def make_payload(n_messages: int) -> dict:
+    messages = []
+    for i in range(n_messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = (
+            "height 90-120cm, container grown, delivery to Bratislava within two weeks"
+            if role == "user" else
+            "Thank you for specifying. You're looking for a Pyrus calleryana that is container grown and "
+            "90-120cm in height. Is there anything else you'd like to specify about this Pyrus calleryana?"
+        )
+        messages.append({"role": role, "content": content, "timestamp": f"2026-10-19T12:{i % 60:02d}:00.000000"})
+    options = [
+        {"title": f"Callery Pear Tree {i} - 3 gal container grown", "link": f"https://www.example-nursery{i}.com/pyrus-calleryana",
+         "snippet": "Pyrus calleryana, container grown, 90-120cm. Ships in 3-5 days. $45.99"}
+        for i in range(10)
+    ]
+    return {
+        "conversation_id": "7f1d2c1e-8f0a-4b7e-9a47-3f0c2f9b1a22",
+        "response": messages[-1]["content"],
+        "productSpecification": {"name": "Pyrus calleryana", "description": "Callery pear", "features": ["Container grown", "90-120cm"],
+                                 "estimatedPrice": "$40-$60", "category": "Plants"},
+        "isSpecificationFinalized": True,
+        "messages": messages,
+        "shoppingOptions": options,
+        "usage": {"prompt_tokens": 1200, "cached_tokens": 1024, "completion_tokens": 150},
+    }
+
+
+def make_request(accept_encoding: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+def fastapi_default(payload: dict) -> bytes:
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def timed(fn, iterations: int) -> tuple:
+    result = fn()
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    variants = [("gzip", make_request("gzip"))]
+    if responses.brotli is not None:
+        variants.append(("br", make_request("br")))
+
+    print(f"{'messages':>8} | {'variant':<11} | {'cpu ms/resp':>11} | {'bytes':>9}")
+    for n_messages in CONVERSATION_LENGTHS:
+        payload = make_payload(n_messages)
+        rows = []
+
+        cpu, body = timed(lambda: fastapi_default(payload), args.iterations)
+        rows.append(("fastapi", cpu, len(body)))
+        cpu, body = timed(lambda: responses.dumps(payload), args.iterations)
+        rows.append(("orjson", cpu, len(body)))
+        cpu, body = timed(lambda: responses.dumps(responses.validated(responses.ChatResponse, payload)), args.iterations)
+        rows.append(("+model", cpu, len(body)))
+        for name, request in variants:
+            cpu, response = timed(lambda: responses.model_response(request, responses.ChatResponse, payload), args.iterations)
+            rows.append((f"+{name}", cpu, len(response.body)))
+
+        cache = responses.SnapshotCache()
+        name, request = variants[-1]
+        cpu, response = timed(lambda: cache.response(request, "conversation", n_messages, lambda: payload), args.iterations)
+        rows.append((f"snapshot {name}", cpu, len(response.body)))
+
+        for variant, cpu_ms, size in rows:
+            print(f"{n_messages:>8} | {variant:<11} | {cpu_ms:>11.3f} | {size:>9,}")
+
+
+if __name__ == "__main__":
+    main()
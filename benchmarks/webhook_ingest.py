@@ -0,0 +1,125 @@
+"""
+Throughput benchmark for WhatsApp webhook ingestion.
+
+Compares, in-process and without HTTP overhead:
+  - full:  verify the HMAC signature and validate every body into WhatsAppWebhookPayload
+           (the previous behaviour plus signature checking)
+  - fast:  verify the HMAC signature, scan for a "messages" key, and only validate
+           message-bearing bodies
+
+for several status/message mixes. Usage (from the repository root):
+    python benchmarks/webhook_ingest.py --bodies 20000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import WhatsAppWebhookPayload  # noqa: E402
+from whatsapp_ingest import has_messages, verify_signature  # noqa: E402
+
+APP_SECRET = "benchmark-secret"
+MIXES = [0.95, 0.8, 0.5]  # fraction of status-only callbacks
+
+
+def _envelope(value: dict) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "102290129340398",
+            "changes": [{"value": value, "field": "messages"}],
+        }],
+    }
+
+
+def status_payload(i: int) -> dict:
+    return _envelope({
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550783881", "phone_number_id": "106540352242922"},
+        "statuses": [{
+            "id": f"wamid.HBgLMTY1MDM4Nzk0MzkVAgARGBJDQjZCMzlEQUE4OTJBMTE4RTUA{i}",
+            "status": random.choice(["sent", "delivered", "read"]),
+            "timestamp": str(1700000000 + i),
+            "recipient_id": "16505551234",
+            "conversation": {"id": "CONVERSATION_ID", "origin": {"type": "service"}},
+            "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+        }],
+    })
+
+
+def message_payload(i: int) -> dict:
+    return _envelope({
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550783881", "phone_number_id": "106540352242922"},
+        "contacts": [{"profile": {"name": "Buyer"}, "wa_id": "16505551234"}],
+        "messages": [{
+            "from": "16505551234",
+            "id": f"wamid.HBgLMTY1MDM4Nzk0MzkVAgASGBQzQUFERjg0NDEzNDdFODU3MUMxMAA{i}",
+            "timestamp": str(1700000000 + i),
+            "text": {"body": "I need 20 Pyrus calleryana, container grown, 90-120cm"},
+            "type": "text",
+        }],
+    })
+
+
+def make_bodies(count: int, status_fraction: float) -> list:
+    bodies = []
+    for i in range(count):
+        payload = status_payload(i) if random.random() < status_fraction else message_payload(i)
+        raw = json.dumps(payload).encode("utf-8")
+        signature = "sha256=" + hmac.new(APP_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+        bodies.append((raw, signature))
+    return bodies
+
+
+def run_full(bodies: list) -> int:
+    parsed = 0
+    for raw, signature in bodies:
+        if not verify_signature(raw, signature, APP_SECRET):
+            raise AssertionError("signature mismatch")
+        WhatsAppWebhookPayload.model_validate_json(raw)
+        parsed += 1
+    return parsed
+
+
+def run_fast(bodies: list) -> int:
+    parsed = 0
+    for raw, signature in bodies:
+        if not verify_signature(raw, signature, APP_SECRET):
+            raise AssertionError("signature mismatch")
+        if has_messages(raw):
+            WhatsAppWebhookPayload.model_validate_json(raw)
+            parsed += 1
+    return parsed
+
+
+def measure(fn, bodies: list) -> tuple:
+    started = time.perf_counter()
+    parsed = fn(bodies)
+    elapsed = time.perf_counter() - started
+    return len(bodies) / elapsed, parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bodies", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print(f"{'status share':>12} | {'full (bodies/s)':>16} | {'fast (bodies/s)':>16} | {'speedup':>7} | parsed (full/fast)")
+    for status_fraction in MIXES:
+        bodies = make_bodies(args.bodies, status_fraction)
+        full_rate, full_parsed = measure(run_full, bodies)
+        fast_rate, fast_parsed = measure(run_fast, bodies)
+        print(f"{status_fraction:>12.0%} | {full_rate:>16,.0f} | {fast_rate:>16,.0f} | {fast_rate / full_rate:>6.1f}x | {full_parsed}/{fast_parsed}")
+
+
+if __name__ == "__main__":
+    main()
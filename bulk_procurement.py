@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import itertools
+import json
+import sys
+import tempfile
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from admission import AdmissionController, AdmissionRejected
+from ai_agent_service import ProcurementAgent
+from shopping_agent import ShoppingAgent
+from search_scheduler import PRIORITY_BULK
+
+# Column / key names that are accepted as the item description, in order of preference
+DESCRIPTION_KEYS = ["description", "item", "product", "name"]
+ID_KEYS = ["id", "item_id", "sku", "line"]
+
+DEFAULT_CONCURRENCY = 4
+# Items accepted per upload over HTTP; the rest of the upload is not processed
+DEFAULT_MAX_ITEMS = 1000
+
+# Uploads up to this size are spooled in memory, larger ones in a temporary file
+SPOOL_MAX_MEMORY = 1024 * 1024
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+class BulkItem:
+    """A single line item read from a bulk upload."""
+    def __init__(self, item_id: str, description: str, error: Optional[str] = None):
+        self.item_id = item_id
+        self.description = description
+        # Set when the input line could not be parsed; the item is reported but not processed
+        self.error = error
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of byte chunks into decoded text lines without buffering the whole body.
+
+    Args:
+        chunks: Raw byte chunks, e.g. from `Request.stream()`
+
+    Returns:
+        An async iterator of lines (without line endings)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def spool_body(chunks: AsyncIterator[bytes]) -> "tempfile.SpooledTemporaryFile":
+    """
+    Read a request body into a spooled temporary file (in memory up to SPOOL_MAX_MEMORY,
+    on disk beyond), rewound and ready to be read.
+
+    The body has to be read before a streaming response starts: Starlette's StreamingResponse
+    listens for client disconnects by calling `receive()`, which consumes (and drops) any body
+    messages that have not been read yet.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        async for chunk in chunks:
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+async def aiter_spooled(spool: "tempfile.SpooledTemporaryFile") -> AsyncIterator[bytes]:
+    """Yield the contents of a spooled body in chunks, closing it when done."""
+    try:
+        while True:
+            chunk = spool.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        spool.close()
+
+
+async def aiter_sync_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    """Adapt a synchronous line iterable (e.g. an open file) to an async iterator."""
+    for line in lines:
+        yield line.rstrip("\r\n")
+
+
+def _pick(record: Dict[str, Any], keys: List[str]) -> Optional[str]:
+    lowered = {str(k).strip().lower(): v for k, v in record.items()}
+    for key in keys:
+        value = lowered.get(key)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+async def parse_csv_items(lines: AsyncIterator[str]) -> AsyncIterator[BulkItem]:
+    """
+    Parse CSV line items. The first row is the header; the description is taken from a
+    `description`/`item`/`product`/`name` column, or the first column otherwise.
+    Quoted fields spanning several lines are supported.
+    """
+    header = None
+    pending = ""
+    row_number = 0
+    async for line in lines:
+        # Keep buffering while a quoted field is still open
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2 == 1:
+            continue
+        raw, pending = pending, ""
+        if not raw.strip():
+            continue
+
+        row = next(csv.reader([raw]))
+        if header is None:
+            header = [column.strip() for column in row]
+            continue
+
+        row_number += 1
+        record = dict(zip(header, row))
+        item_id = _pick(record, ID_KEYS) or str(row_number)
+        description = _pick(record, DESCRIPTION_KEYS) or (row[0].strip() if row else "")
+        if not description:
+            yield BulkItem(item_id, "", error="Empty item description")
+        else:
+            yield BulkItem(item_id, description)
+
+    if pending.strip():
+        row_number += 1
+        yield BulkItem(str(row_number), "", error="Unterminated quoted field at end of input")
+
+
+async def parse_jsonl_items(lines: AsyncIterator[str]) -> AsyncIterator[BulkItem]:
+    """
+    Parse JSONL line items. Each line is either a JSON string (the description) or an
+    object with a `description`/`item`/`product`/`name` key and an optional `id`.
+    """
+    line_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        line_number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield BulkItem(str(line_number), "", error=f"Invalid JSON: {e}")
+            continue
+
+        if isinstance(record, str):
+            item_id, description = str(line_number), record.strip()
+        elif isinstance(record, dict):
+            item_id = _pick(record, ID_KEYS) or str(line_number)
+            description = _pick(record, DESCRIPTION_KEYS) or ""
+        else:
+            yield BulkItem(str(line_number), "", error="Expected a JSON object or string")
+            continue
+
+        if not description:
+            yield BulkItem(item_id, "", error="Empty item description")
+        else:
+            yield BulkItem(item_id, description)
+
+
+def parse_items(lines: AsyncIterator[str], input_format: str) -> AsyncIterator[BulkItem]:
+    if input_format == "csv":
+        return parse_csv_items(lines)
+    if input_format in ("jsonl", "ndjson"):
+        return parse_jsonl_items(lines)
+    raise ValueError(f"Unsupported bulk input format: {input_format}")
+
+
+async def limit_items(items: AsyncIterator[BulkItem], max_items: int) -> AsyncIterator[BulkItem]:
+    """Pass through the first `max_items` items, then report one error item and stop reading."""
+    count = 0
+    async for item in items:
+        count += 1
+        if count > max_items:
+            yield BulkItem(str(count), "", error=f"Upload exceeds the limit of {max_items} items; the remaining items were not processed")
+            return
+        yield item
+
+
+class BulkProcurementRunner:
+    """
+    Runs forced-finalization spec generation and shopping searches for many line items,
+    keeping at most `concurrency` items in flight and yielding results as they complete.
+
+    With an `admission` controller, every item also holds one of its in-flight slots (under
+    its own `<admission_key>:<n>` key) while it is processed. Items never queue for a slot:
+    when the server is at capacity they wait `retry_after` and try again, so interactive
+    requests keep priority over bulk runs.
+    """
+    def __init__(self, shopping_agent: ShoppingAgent,
+                 agent_factory: Callable[[], ProcurementAgent] = ProcurementAgent,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 admission: Optional[AdmissionController] = None,
+                 admission_key: str = "bulk"):
+        self.shopping_agent = shopping_agent
+        # ProcurementAgent keeps no per-conversation state, so one instance serves all items
+        self.procurement_agent = agent_factory()
+        self.concurrency = max(1, concurrency)
+        self.admission = admission
+        self.admission_key = admission_key
+        self._item_numbers = itertools.count(1)
+
+    async def run(self, items: AsyncIterator[BulkItem]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process line items, yielding one result dict per item in completion order.
+
+        Input is only read while fewer than `concurrency` items are in flight, so memory
+        use does not grow with the size of the upload.
+        """
+        pending = set()
+        try:
+            async for item in items:
+                pending.add(asyncio.ensure_future(self._process_item(item)))
+                if len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # The consumer went away (e.g. client disconnect) - don't leave work running
+            for task in pending:
+                task.cancel()
+
+    async def _process_item(self, item: BulkItem) -> Dict[str, Any]:
+        if self.admission is None or item.error:
+            return await self._process_admitted_item(item)
+        key = f"{self.admission_key}:{next(self._item_numbers)}"
+        while True:
+            try:
+                async with self.admission.admit(key, queue=False):
+                    return await self._process_admitted_item(item)
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def _process_admitted_item(self, item: BulkItem) -> Dict[str, Any]:
+        result = {
+            "id": item.item_id,
+            "description": item.description,
+            "status": "error",
+            "message": None,
+            "specification": None,
+            "shopping_options": [],
+            "usage": None,
+            "error": item.error,
+        }
+        if item.error:
+            return result
+
+        try:
+            procurement_result = await self.procurement_agent.process_message(item.description, force_finalize=True)
+            result["message"] = procurement_result["message"]
+            result["usage"] = procurement_result.get("usage")
+            if not procurement_result["success"]:
+                result["error"] = procurement_result["message"]
+                return result
+
+            specification = procurement_result["specification"]
+            if not specification:
+                result["error"] = "Agent did not return a specification"
+                return result
+            result["specification"] = specification
+
+            result["shopping_options"] = await self.shopping_agent.find_options(specification, priority=PRIORITY_BULK)
+            result["status"] = "ok"
+        except Exception as e:
+            print(f"Bulk: error processing item {item.item_id}: {e}")
+            result["error"] = str(e)
+        return result
+
+
+async def stream_ndjson(results: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Encode results as NDJSON, one line per item."""
+    async for result in results:
+        yield (json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _run_cli(args: argparse.Namespace) -> int:
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    runner = BulkProcurementRunner(ShoppingAgent(), concurrency=args.concurrency)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    counts = {"ok": 0, "error": 0}
+    try:
+        with open(args.input, "r", encoding="utf-8-sig", newline="") as f:
+            items = parse_items(aiter_sync_lines(f), input_format)
+            async for result in runner.run(items):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[result["status"]] += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"Bulk: processed {counts['ok'] + counts['error']} items ({counts['ok']} ok, {counts['error']} failed)", file=sys.stderr)
+    return 0 if counts["error"] == 0 else 1
+
+
+def main() -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate product specifications and shopping options for a CSV/JSONL file of line items.")
+    parser.add_argument("input", help="CSV or JSONL file with one item description per row/line")
+    parser.add_argument("-o", "--output", help="NDJSON output file (defaults to stdout)")
+    parser.add_argument("-f", "--format", choices=["csv", "jsonl"], help="Input format (inferred from the file extension by default)")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of items processed at once")
+    return asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
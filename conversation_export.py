@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import sys
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from responses import dumps
+
+if TYPE_CHECKING:
+    import pyarrow
+
+
+EXPORT_FORMATS = ["ndjson", "arrow", "parquet"]
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+FILE_EXTENSIONS = {"ndjson": "ndjson", "arrow": "arrows", "parquet": "parquet"}
+
+# Rows per Arrow record batch / Parquet row group (and per NDJSON write)
+BATCH_SIZE = 1000
+
+# Every exported row has the same flat set of columns; `record_type` says which ones are filled:
+#   message:         timestamp, role, content
+#   specification:   timestamp (finalized at), spec_*
+#   shopping_option: timestamp (finalized at), spec_name, option_*
+COLUMNS = [
+    "record_type", "conversation_id", "timestamp", "role", "content",
+    "spec_name", "spec_description", "spec_features", "spec_estimated_price", "spec_category",
+    "option_rank", "option_title", "option_link", "option_snippet",
+]
+
+
+class ExportFormatUnavailable(Exception):
+    """Raised when a columnar format is requested but pyarrow is not installed."""
+
+
+def _pyarrow():
+    """
+    Import pyarrow on first use: it is optional (without it only NDJSON exports are
+    available) and too slow to import to load it with the server.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def normalize_timestamp(value: str) -> str:
+    """
+    Parse an ISO 8601 `since`/`until` value into the format timestamps are stored in (naive
+    local time, `datetime.isoformat()`), so they can be compared as strings.
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 date or datetime
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def _in_window(timestamp: Optional[str], since: Optional[str], until: str) -> bool:
+    if not timestamp:
+        # Messages restored from a client cache carry no timestamp; only full exports include them
+        return since is None
+    return (since is None or timestamp > since) and timestamp <= until
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def _features(value: Any) -> Optional[List[str]]:
+    if not value:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [str(feature) for feature in value]
+    return [str(value)]
+
+
+def _row(record_type: str, conversation_id: str, timestamp: Optional[str], **values: Any) -> Dict[str, Any]:
+    row = dict.fromkeys(COLUMNS)
+    row.update(record_type=record_type, conversation_id=conversation_id, timestamp=timestamp, **values)
+    return row
+
+
+def iter_conversation_rows(conversation_id: str, conversation: Dict[str, Any],
+                           since: Optional[str], until: str) -> Iterator[Dict[str, Any]]:
+    """Yield the export rows of one conversation whose timestamps fall in (since, until]."""
+    # Only look at what existed when we got here; turns appended meanwhile belong to the next export
+    messages = conversation.get("messages", [])
+    for message in islice(messages, len(messages)):
+        timestamp = message.get("timestamp")
+        if _in_window(timestamp, since, until):
+            yield _row("message", conversation_id, timestamp,
+                       role=message.get("role"), content=_text(message.get("content")))
+
+    specifications = conversation.get("specifications", [])
+    for finalized in islice(specifications, len(specifications)):
+        timestamp = finalized.get("finalized_at")
+        if not _in_window(timestamp, since, until):
+            continue
+        spec = finalized.get("specification") or {}
+        spec_name = _text(spec.get("name"))
+        yield _row("specification", conversation_id, timestamp,
+                   spec_name=spec_name,
+                   spec_description=_text(spec.get("description")),
+                   spec_features=_features(spec.get("features")),
+                   spec_estimated_price=_text(spec.get("estimatedPrice")),
+                   spec_category=_text(spec.get("category")))
+        for rank, option in enumerate(finalized.get("shopping_options") or [], start=1):
+            yield _row("shopping_option", conversation_id, timestamp,
+                       spec_name=spec_name,
+                       option_rank=rank,
+                       option_title=_text(option.get("title")),
+                       option_link=_text(option.get("link")),
+                       option_snippet=_text(option.get("snippet")))
+
+
+def iter_export_rows(conversations: Dict[str, Dict[str, Any]], since: Optional[str] = None,
+                     until: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily walk the conversation store and yield flat export rows (see COLUMNS).
+
+    Only the conversation ids are copied up front; each conversation is read when it is
+    reached, so memory use does not grow with the size of the store.
+
+    Args:
+        conversations: The conversation store (conversation id -> conversation dict)
+        since: Exclusive lower bound on row timestamps (normalized ISO string), or None for everything
+        until: Inclusive upper bound; defaults to now. Pass the same value as the next `since`.
+    """
+    until = until or datetime.now().isoformat()
+    for conversation_id in list(conversations):
+        conversation = conversations.get(conversation_id)
+        if conversation is None:
+            continue
+        updated_at = conversation.get("updated_at")
+        if since is not None and updated_at and updated_at <= since:
+            # Nothing new since the last export
+            continue
+        yield from iter_conversation_rows(conversation_id, conversation, since, until)
+
+
+def batched(rows: Iterable[Dict[str, Any]], size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_schema(pa) -> "pyarrow.Schema":
+    string = pa.string()
+    return pa.schema([
+        ("record_type", string),
+        ("conversation_id", string),
+        ("timestamp", string),
+        ("role", string),
+        ("content", string),
+        ("spec_name", string),
+        ("spec_description", string),
+        ("spec_features", pa.list_(string)),
+        ("spec_estimated_price", string),
+        ("spec_category", string),
+        ("option_rank", pa.int32()),
+        ("option_title", string),
+        ("option_link", string),
+        ("option_snippet", string),
+    ])
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands written bytes back to the caller instead of
+    storing them, so Arrow/Parquet output can be streamed as it is produced.
+    """
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_ndjson(rows: Iterable[Dict[str, Any]], batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    for batch in batched(rows, batch_size):
+        yield b"".join(dumps(row) + b"\n" for row in batch)
+
+
+def _stream_columnar(pa, rows: Iterable[Dict[str, Any]], open_writer, write_batch, batch_size: int) -> Iterator[bytes]:
+    schema = export_schema(pa)
+    sink = _ChunkSink()
+    writer = open_writer(sink, schema)
+    try:
+        for batch in batched(rows, batch_size):
+            write_batch(writer, pa.RecordBatch.from_pylist(batch, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_arrow(pa, rows: Iterable[Dict[str, Any]], batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """Arrow IPC stream format, one record batch per `batch_size` rows."""
+    return _stream_columnar(pa, rows, pa.ipc.new_stream, lambda writer, batch: writer.write_batch(batch), batch_size)
+
+
+def stream_parquet(pa, rows: Iterable[Dict[str, Any]], batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """Parquet file, one row group per `batch_size` rows."""
+    return _stream_columnar(
+        pa,
+        rows,
+        lambda sink, schema: pa.parquet.ParquetWriter(sink, schema, compression="zstd"),
+        lambda writer, batch: writer.write_batch(batch, row_group_size=batch_size),
+        batch_size,
+    )
+
+
+def stream_export(rows: Iterable[Dict[str, Any]], format: str, batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Encode export rows as a stream of byte chunks in the given format.
+
+    Raises:
+        ValueError: If the format is unknown
+        ExportFormatUnavailable: If a columnar format is requested without pyarrow installed
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {format}")
+    if format == "ndjson":
+        return stream_ndjson(rows, batch_size)
+    pa = _pyarrow()
+    if pa is None:
+        raise ExportFormatUnavailable(f"The {format} export format requires pyarrow to be installed")
+    if format == "arrow":
+        return stream_arrow(pa, rows, batch_size)
+    return stream_parquet(pa, rows, batch_size)
+
+
+# --- CLI: pull an export from a running server, remembering where the last one stopped ---
+
+def _load_state(path: str) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(path: str, state: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def main() -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export conversations, finalized specifications and shopping options from a running server.")
+    parser.add_argument("--url", default=os.getenv("EXPORT_SERVER_URL", "http://localhost:8000"), help="Base URL of the server")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("-o", "--output", help="Output file (defaults to export-<until>.<ext>)")
+    parser.add_argument("--since", help="Only export rows after this ISO timestamp")
+    parser.add_argument("--state-file", help="Incremental mode: read `since` from and store `until` in this JSON file")
+    args = parser.parse_args()
+
+    state = _load_state(args.state_file)
+    since = args.since or state.get("until")
+    query = {"format": args.format}
+    if since:
+        query["since"] = since
+
+    request = urllib.request.Request(f"{args.url.rstrip('/')}/api/export?{urllib.parse.urlencode(query)}")
+    token = os.getenv("ADMIN_API_TOKEN")
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+
+    with urllib.request.urlopen(request) as response:
+        until = response.headers["X-Export-Until"]
+        output = args.output or f"export-{until.replace(':', '')}.{FILE_EXTENSIONS[args.format]}"
+        written = 0
+        with open(output, "wb") as f:
+            while True:
+                chunk = response.read(64 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+
+    if args.state_file:
+        # Only advance the cursor once the export was written completely
+        _save_state(args.state_file, {"until": until})
+    print(f"Exported rows from {since or 'the beginning'} to {until}: {written:,} bytes written to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
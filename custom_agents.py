@@ -1,63 +1,107 @@
 import os
-import openai
 import json
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from llm_resilience import ResilientCaller
+from prompt_assembly import TokenUsage, assemble_messages, record_usage
+
+_openai_caller: Optional[ResilientCaller] = None
+
+
+def get_openai_caller() -> ResilientCaller:
+    """
+    Caller shared by all agents so latency stats and circuit state reflect the upstream as a whole.
+    Created on first use so that its settings are read after the environment has been loaded.
+    """
+    global _openai_caller
+    if _openai_caller is None:
+        _openai_caller = ResilientCaller.from_env("openai")
+    return _openai_caller
 
 class Agent:
     def __init__(self, name: str, instructions: str):
         self.name = name
         self.instructions = instructions
-        # Initialize the OpenAI client
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self._client = None
+        # warm_up() may run in a worker thread while a first turn needs the client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use: importing openai is the slowest part of startup.
+        # Retries and timeouts are handled by the shared ResilientCaller.
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import openai
+                    self._client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return self._client
+
+    def warm_up(self) -> None:
+        """
+        Create the OpenAI client (and import openai) now rather than on the first call.
+        Safe to call from a worker thread.
+        """
+        _ = self.client
         
-    async def process_message(self, user_message: str, chat_history: List[Dict[str, str]] = None) -> str:
+    async def process_message(self, user_message: str, chat_history: List[Dict[str, str]] = None,
+                              additional_instructions: Optional[str] = None) -> str:
         """
         Process a message using the OpenAI API, ensuring the chat history is used for context.
         
         Args:
             user_message: The message from the user
-            chat_history: Previous messages in the conversation
+            chat_history: Previous messages in the conversation (without user_message)
+            additional_instructions: Per-turn instructions placed after the history
             
         Returns:
             The AI's response
+
+        Raises:
+            LLMUnavailableError: If the OpenAI API could not be reached in time or the circuit is open
+        """
+        messages = assemble_messages(self.instructions, chat_history, user_message, additional_instructions)
+        response_text, _ = await self.complete(messages)
+        return response_text
+
+    async def complete(self, messages: List[Dict[str, str]]) -> Tuple[str, TokenUsage]:
+        """
+        Send an already assembled message list to the OpenAI API.
+
+        Returns:
+            The AI's response and the token usage of the call
         """
-        if not chat_history:
-            # Start with system message if no history provided
-            messages = [{"role": "system", "content": self.instructions}]
-        else:
-            # Use provided history, ensuring system message exists
-            if not any(msg.get("role") == "system" for msg in chat_history):
-                messages = [{"role": "system", "content": self.instructions}] + chat_history
-            else:
-                messages = chat_history.copy()
-        
-        # Add the current user message
-        messages.append({"role": "user", "content": user_message})
-        
         # Debug log to see what's being sent
         print(f"Sending {len(messages)} messages to OpenAI API")
         print(f"Last few messages: {json.dumps(messages[-3:], indent=2)}")
         
         try:
             # Use the current OpenAI API format
-            response = self.client.chat.completions.create(
+            openai_caller = get_openai_caller()
+            response = await openai_caller.call(lambda: self.client.chat.completions.create(
                 model="gpt-4",  # Or your preferred model
                 messages=messages,
                 temperature=0.7,
-                max_tokens=2000
-            )
+                max_tokens=2000,
+                timeout=openai_caller.timeout
+            ))
             
             assistant_response = response.choices[0].message.content
-            return assistant_response
+            usage = TokenUsage.from_response(response)
+            record_usage(usage)
+            print(f"Token usage: {usage.prompt_tokens} prompt ({usage.cached_tokens} cached), {usage.completion_tokens} completion")
+            return assistant_response, usage
             
         except Exception as e:
+            # Let callers decide how to surface failures instead of returning error text as a reply
             print(f"Error in OpenAI API call: {e}")
-            return f"I encountered an error: {str(e)}"
+            raise
 
 class Result:
     """Simple class to match the expected interface"""
-    def __init__(self, final_output):
+    def __init__(self, final_output, usage: Optional[TokenUsage] = None):
         self.final_output = final_output
+        self.usage = usage or TokenUsage()
 
 class Runner:
     """
@@ -69,13 +113,17 @@ class Runner:
         """
         Run a message through an agent with context.
         
+        The chat history in the context is only read: the agent's instructions form a stable
+        prompt prefix and the per-turn instructions are sent after the history, so neither
+        the stored history nor the cacheable prefix changes between turns.
+        
         Args:
             agent: The agent to process the message
-            user_message: The message from the user
-            context: Additional context, including chat_history
+            user_message: The message from the user (not already part of chat_history)
+            context: Additional context, including chat_history and instructions
             
         Returns:
-            Result object with final_output attribute
+            Result object with final_output and usage attributes
         """
         chat_history = None
         additional_instructions = None
@@ -86,27 +134,10 @@ class Runner:
             
             # Extract additional instructions if available
             additional_instructions = context.get("instructions")
-            
-            # If there are additional instructions, add or update the system message
-            if additional_instructions and chat_history:
-                # Find system message
-                system_idx = next((i for i, msg in enumerate(chat_history) 
-                                if msg.get("role") == "system"), None)
-                
-                if system_idx is not None:
-                    # Update existing system message with additional instructions
-                    chat_history[system_idx]["content"] = (
-                        f"{agent.instructions}\n\n{additional_instructions}"
-                    )
-                else:
-                    # Add system message with combined instructions
-                    chat_history.insert(0, {
-                        "role": "system", 
-                        "content": f"{agent.instructions}\n\n{additional_instructions}"
-                    })
         
         # Process the message with the agent
-        response = await agent.process_message(user_message, chat_history)
+        messages = assemble_messages(agent.instructions, chat_history, user_message, additional_instructions)
+        response, usage = await agent.complete(messages)
         
         # Return a Result object to match the expected interface
-        return Result(final_output=response) 
\ No newline at end of file
+        return Result(final_output=response, usage=usage)
@@ -0,0 +1,261 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from metrics import Counters, LatencyRecorder
+
+T = TypeVar("T")
+
+_retryable_errors: Optional[Tuple[type, ...]] = None
+
+
+def retryable_errors() -> Tuple[type, ...]:
+    """Errors worth retrying: the request may succeed if sent again."""
+    global _retryable_errors
+    if _retryable_errors is None:
+        # Imported on first use; openai is slow to import and not needed until the first call
+        import openai
+        _retryable_errors = (
+            asyncio.TimeoutError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+    return _retryable_errors
+
+
+class LLMUnavailableError(Exception):
+    """The LLM upstream could not produce a response (retries exhausted or circuit open)."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    closed:    calls go through; consecutive failures are counted
+    open:      calls fail fast until `recovery_timeout` has passed
+    half_open: one trial call is let through; success closes the circuit, failure reopens it.
+               A trial that ends without an outcome (cancelled, deadline) is released; one
+               that never reports back is given up on after `recovery_timeout`.
+    """
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                now = time.monotonic()
+                if not self._trial_in_flight or now - self._trial_started >= self.recovery_timeout:
+                    self._trial_in_flight = True
+                    self._trial_started = now
+                    return True
+            return False
+
+    def release_trial(self) -> None:
+        """Let another trial through if the current one finished without recording an outcome."""
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Count a failure. Returns True if this failure opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                was_open = self.state == "open"
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                return not was_open
+            return False
+
+
+class ResilientCaller:
+    """
+    Wraps async upstream calls with a deadline, hedging, retries and a circuit breaker.
+
+    - Every call has an overall deadline covering all attempts.
+    - If an attempt has not finished after the observed p95 latency, a duplicate (hedge)
+      request is started and whichever finishes first wins.
+    - Retryable errors are retried with exponential backoff and full jitter.
+    - Repeated failures open the circuit breaker, after which calls fail fast until the
+      upstream has had time to recover.
+    """
+    def __init__(self, name: str, timeout: float = 60.0, max_attempts: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedging: bool = True, hedge_percentile: float = 95, hedge_min_samples: int = 20,
+                 hedge_min_delay: float = 2.0, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker()
+
+        self.latency = LatencyRecorder()
+        self.counters = Counters(
+            "calls", "successes", "failures", "retries", "timeouts",
+            "hedges", "hedge_wins", "circuit_rejections", "circuit_opened",
+        )
+
+    @classmethod
+    def from_env(cls, name: str) -> "ResilientCaller":
+        return cls(
+            name,
+            timeout=float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60")),
+            max_attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "3")),
+            hedging=os.getenv("OPENAI_HEDGING", "1") != "0",
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5")),
+                recovery_timeout=float(os.getenv("OPENAI_BREAKER_RECOVERY_SECONDS", "30")),
+            ),
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before sending a hedge, or None if there is not enough latency data yet."""
+        if not self.hedging or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call `fn` with deadline, hedging, retries and circuit breaking.
+
+        Args:
+            fn: Zero-argument factory returning a new awaitable for each attempt
+
+        Raises:
+            CircuitOpenError: The circuit is open; upstream was not called
+            LLMUnavailableError: Retryable failures persisted until attempts or time ran out
+            Exception: Non-retryable errors from `fn` are raised unchanged
+        """
+        self.counters.inc("calls")
+        if not self.breaker.allow():
+            self.counters.inc("circuit_rejections")
+            raise CircuitOpenError(f"{self.name} circuit is open; failing fast")
+
+        is_trial = self.breaker.state == "half_open"
+        try:
+            return await self._call_with_retries(fn)
+        finally:
+            if is_trial:
+                # No-op if the trial closed or reopened the circuit
+                self.breaker.release_trial()
+
+    async def _call_with_retries(self, fn: Callable[[], Awaitable[T]]) -> T:
+        deadline = time.monotonic() + self.timeout
+        last_error: Optional[BaseException] = None
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.monotonic()
+            try:
+                result = await self._hedged(fn, remaining)
+            except retryable_errors() as e:
+                last_error = e
+                if isinstance(e, asyncio.TimeoutError):
+                    self.counters.inc("timeouts")
+                if self.breaker.record_failure():
+                    self.counters.inc("circuit_opened")
+                    print(f"ResilientCaller[{self.name}]: circuit opened after repeated failures")
+                if self.breaker.state == "open" or attempt == self.max_attempts:
+                    break
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                if time.monotonic() + backoff >= deadline:
+                    break
+                self.counters.inc("retries")
+                print(f"ResilientCaller[{self.name}]: attempt {attempt} failed ({type(e).__name__}), retrying in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+                continue
+            except Exception:
+                # Upstream answered, just not successfully (e.g. bad request) - that is not a health problem
+                self.breaker.record_success()
+                self.counters.inc("failures")
+                raise
+
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            self.counters.inc("successes")
+            return result
+
+        self.counters.inc("failures")
+        raise LLMUnavailableError(f"{self.name} unavailable: {type(last_error).__name__ if last_error else 'deadline exceeded'}") from last_error
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]], timeout: float) -> T:
+        """Run one attempt, sending a single hedge request if it is slower than usual."""
+        deadline = time.monotonic() + timeout
+        primary = asyncio.ensure_future(fn())
+        tasks = [primary]
+        hedge_delay = self.hedge_delay()
+        last_error: Optional[BaseException] = None
+        try:
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait_for = remaining
+                can_hedge = hedge_delay is not None and len(tasks) == 1 and last_error is None
+                if can_hedge:
+                    wait_for = min(remaining, hedge_delay)
+
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge and wait_for < remaining:
+                        self.counters.inc("hedges")
+                        tasks.append(asyncio.ensure_future(fn()))
+                        hedge_delay = None
+                        continue
+                    raise asyncio.TimeoutError()
+
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.counters.inc("hedge_wins")
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Metrics for the /api/metrics endpoint."""
+        delay = self.hedge_delay()
+        return {
+            "circuit_state": self.breaker.state,
+            "latency": self.latency.snapshot(),
+            "hedge_delay_ms": round(delay * 1000, 2) if delay is not None else None,
+            "counters": self.counters.snapshot(),
+        }
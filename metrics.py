@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class LatencyRecorder:
+    """
+    Keeps a bounded window of recent latency samples (in seconds) and reports percentiles.
+    """
+    def __init__(self, max_samples: int = 1024):
+        self._samples = deque(maxlen=max_samples)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the p-th percentile (0-100) of the current window, or None if empty."""
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summary in milliseconds, suitable for a JSON metrics response."""
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 2) if value is not None else None
+
+        with self._lock:
+            count = self._count
+            window_max = max(self._samples) if self._samples else None
+        return {
+            "count": count,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(window_max),
+        }
+
+
+class Counters:
+    """Thread-safe named counters."""
+    def __init__(self, *names: str):
+        self._values = {name: 0 for name in names}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        return self._values.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
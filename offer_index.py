@@ -0,0 +1,473 @@
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import Counters, LatencyRecorder
+from shopping_ranker import BM25_B, BM25_K1, TITLE_REPEAT, build_query_weights, normalize_link, rank_options, tokenize
+
+# Callable that turns a list of texts into an (n, dim) float array, e.g. an embeddings API call
+EmbedFn = Callable[[List[str]], np.ndarray]
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _offer_text(offer: Dict[str, Any]) -> str:
+    return f"{offer.get('title', '')} {offer.get('snippet', '')}"
+
+
+def _offer_tokens(offer: Dict[str, Any]) -> List[str]:
+    # Same document model as shopping_ranker so scores are comparable
+    return tokenize(offer.get("title")) * TITLE_REPEAT + tokenize(offer.get("snippet"))
+
+
+class _Segment:
+    """
+    An immutable, memory-mapped index segment on disk.
+
+    Files:
+        docs.jsonl       offers, one JSON object per line (read through mmap)
+        offsets.npy      int64 byte offsets of each line in docs.jsonl (n + 1 entries)
+        terms.json       term -> [start, count] into the postings arrays
+        postings.npy     int32 document ids, grouped by term
+        tfs.npy          uint16 term frequencies matching postings.npy
+        doc_lengths.npy  int32 token count per document
+        vectors.npy      float32 (n, dim) embeddings, only if an embed function was configured
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, "postings.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode="r")
+        vectors_path = os.path.join(path, "vectors.npy")
+        self.vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        self._file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.total_length = int(self.doc_lengths.sum())
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def postings_for(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        span = self.terms.get(term)
+        if not span:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+        start, count = span
+        return self.postings[start:start + count], self.tfs[start:start + count]
+
+    def doc(self, i: int) -> Dict[str, Any]:
+        return json.loads(self._docs[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def iter_docs(self):
+        for i in range(len(self)):
+            yield self.doc(i), (self.vectors[i] if self.vectors is not None else None)
+
+    def close(self) -> None:
+        self._docs.close()
+        self._file.close()
+
+    @staticmethod
+    def write(path: str, offers: List[Dict[str, Any]], vectors: Optional[np.ndarray] = None) -> None:
+        """Write offers as a new segment directory (written to a temp dir, then renamed)."""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        offsets = [0]
+        term_postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        with open(os.path.join(tmp_path, "docs.jsonl"), "wb") as f:
+            for doc_id, offer in enumerate(offers):
+                line = (json.dumps(offer, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+
+                tokens = _offer_tokens(offer)
+                doc_lengths.append(len(tokens))
+                counts: Dict[str, int] = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    term_postings.setdefault(token, []).append((doc_id, tf))
+
+        terms = {}
+        postings, tfs = [], []
+        for term in sorted(term_postings):
+            entries = term_postings[term]
+            terms[term] = [len(postings), len(entries)]
+            postings.extend(doc_id for doc_id, _ in entries)
+            tfs.extend(min(tf, 65535) for _, tf in entries)
+
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "postings.npy"), np.array(postings, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "tfs.npy"), np.array(tfs, dtype=np.uint16))
+        np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.array(doc_lengths, dtype=np.int32))
+        if vectors is not None:
+            np.save(os.path.join(tmp_path, "vectors.npy"), np.asarray(vectors, dtype=np.float32))
+        with open(os.path.join(tmp_path, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f)
+        os.replace(tmp_path, path)
+
+
+class _LiveSegment:
+    """In-memory segment for offers added since the last flush."""
+    def __init__(self):
+        self.offers: List[Dict[str, Any]] = []
+        self.vectors: List[np.ndarray] = []
+        self.terms: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.offers)
+
+    def add(self, offer: Dict[str, Any], vector: Optional[np.ndarray]) -> None:
+        doc_id = len(self.offers)
+        self.offers.append(offer)
+        if vector is not None:
+            self.vectors.append(vector)
+        tokens = _offer_tokens(offer)
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        for token in tokens:
+            postings = self.terms.setdefault(token, {})
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def postings_for(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        postings = self.terms.get(term)
+        if not postings:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+        return np.fromiter(postings.keys(), dtype=np.int32), np.fromiter(postings.values(), dtype=np.uint16)
+
+    def doc(self, i: int) -> Dict[str, Any]:
+        return self.offers[i]
+
+    def vector_matrix(self) -> Optional[np.ndarray]:
+        if not self.vectors or len(self.vectors) != len(self.offers):
+            return None
+        return np.vstack(self.vectors)
+
+
+class OfferIndex:
+    """
+    Persistent local index of shopping offers seen in previous searches.
+
+    Every result returned by the shopping search is added incrementally. Lookups score
+    indexed offers against a specification with BM25 (plus cosine similarity when an
+    embedding function is passed as `embed_fn`) and only answer when the best matches cover the
+    specification well enough; otherwise the caller should search upstream.
+
+    Opening an index reads every stored offer and `add()` may write a segment, so async
+    callers should do both in a worker thread; lookups only take the lock briefly.
+
+    New offers are buffered in memory and flushed to immutable memory-mapped segments.
+    Segments are merged, and expired offers dropped, by a background compaction thread.
+    """
+    def __init__(self, directory: str, embed_fn: Optional[EmbedFn] = None,
+                 confidence_threshold: float = 0.75, min_results: int = 3,
+                 flush_threshold: int = 200, max_segments: int = 8,
+                 max_age_seconds: float = 14 * 24 * 3600):
+        self.directory = directory
+        self.embed_fn = embed_fn
+        self.confidence_threshold = confidence_threshold
+        self.min_results = min_results
+        self.flush_threshold = flush_threshold
+        self.max_segments = max_segments
+        # Prices and stock change, so old offers should not be served as fresh results
+        self.max_age_seconds = max_age_seconds
+
+        self._lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._segments: List[_Segment] = []
+        self._next_segment = 1
+        self._live = _LiveSegment()
+        # Buffers that are being written to disk by flush()
+        self._flushing: List[_LiveSegment] = []
+        self._known_links = set()
+        self.counters = Counters("lookups", "hits", "misses", "offers_added", "compactions")
+        self.lookup_latency = LatencyRecorder()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_manifest()
+
+    @classmethod
+    def from_env(cls) -> Optional["OfferIndex"]:
+        """
+        Build the index from OFFER_INDEX_PATH; an empty value disables it.
+
+        Embeddings are not configurable here: `embed_fn` is called synchronously during
+        lookups, so it is only available when constructing an OfferIndex directly.
+        """
+        path = os.getenv("OFFER_INDEX_PATH", ".offer_index")
+        if not path:
+            return None
+        return cls(path, confidence_threshold=float(os.getenv("OFFER_INDEX_CONFIDENCE", "0.75")))
+
+    # --- Persistence ---
+
+    def _load_manifest(self) -> None:
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._next_segment = manifest.get("next_segment", 1)
+            for name in manifest.get("segments", []):
+                segment = _Segment(os.path.join(self.directory, name))
+                self._segments.append(segment)
+                for i in range(len(segment)):
+                    self._known_links.add(normalize_link(segment.doc(i).get("link", "")))
+            print(f"OfferIndex: Loaded {len(self._segments)} segments ({self.size} offers) from {self.directory}")
+        except (OSError, ValueError) as e:
+            print(f"OfferIndex: Could not load index from {self.directory}, starting empty: {e}")
+            self._segments = []
+            self._known_links = set()
+
+    def _write_manifest(self) -> None:
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segments": [s.name for s in self._segments], "next_segment": self._next_segment}, f)
+        os.replace(tmp_path, manifest_path)
+
+    def _new_segment_path(self) -> str:
+        name = f"seg-{self._next_segment:06d}"
+        self._next_segment += 1
+        return os.path.join(self.directory, name)
+
+    @property
+    def size(self) -> int:
+        return sum(len(s) for s in self._segments) + sum(len(s) for s in self._flushing) + len(self._live)
+
+    # --- Indexing ---
+
+    def add(self, offers: List[Dict[str, str]]) -> int:
+        """
+        Add search results to the index, skipping offers whose link is already indexed.
+
+        Returns:
+            The number of offers added
+        """
+        now = time.time()
+        with self._lock:
+            new_offers = []
+            for offer in offers:
+                link_key = normalize_link(offer.get("link", ""))
+                if not link_key or link_key in self._known_links:
+                    continue
+                self._known_links.add(link_key)
+                new_offers.append({
+                    "title": offer.get("title", ""),
+                    "link": offer.get("link", ""),
+                    "snippet": offer.get("snippet", ""),
+                    "indexed_at": now,
+                })
+            if not new_offers:
+                return 0
+
+            vectors = self._embed([_offer_text(o) for o in new_offers])
+            for i, offer in enumerate(new_offers):
+                self._live.add(offer, vectors[i] if vectors is not None else None)
+
+            self.counters.inc("offers_added", len(new_offers))
+            if len(self._live) >= self.flush_threshold:
+                self.flush()
+            return len(new_offers)
+
+    def _embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        if not self.embed_fn or not texts:
+            return None
+        try:
+            vectors = np.asarray(self.embed_fn(texts), dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors / np.where(norms == 0, 1, norms)
+        except Exception as e:
+            print(f"OfferIndex: Embedding failed, indexing without vectors: {e}")
+            return None
+
+    def flush(self) -> None:
+        """Write buffered offers to a new on-disk segment."""
+        with self._lock:
+            if not len(self._live):
+                return
+            # The buffer stays searchable while it is written; new offers go to a fresh one
+            live, self._live = self._live, _LiveSegment()
+            self._flushing.append(live)
+            path = self._new_segment_path()
+
+        # Writing happens outside the lock, so lookups are not held up by disk I/O
+        try:
+            _Segment.write(path, live.offers, live.vector_matrix())
+            segment = _Segment(path)
+        except Exception:
+            with self._lock:
+                self._flushing.remove(live)
+                vectors = live.vectors if len(live.vectors) == len(live.offers) else [None] * len(live.offers)
+                for offer, vector in zip(live.offers, vectors):
+                    self._live.add(offer, vector)
+            raise
+        with self._lock:
+            self._flushing.remove(live)
+            self._segments.append(segment)
+            self._write_manifest()
+        print(f"OfferIndex: Flushed segment {os.path.basename(path)} ({self.size} offers total)")
+
+        if len(self._segments) > self.max_segments:
+            self.compact_in_background()
+
+    # --- Compaction ---
+
+    def compact_in_background(self) -> bool:
+        """Start a compaction thread unless one is already running."""
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return False
+        self._compaction_thread = threading.Thread(target=self.compact, name="offer-index-compaction", daemon=True)
+        self._compaction_thread.start()
+        return True
+
+    def compact(self) -> None:
+        """Merge all on-disk segments into one, dropping expired offers."""
+        with self._lock:
+            segments = list(self._segments)
+            if len(segments) < 2 and not any(self._has_expired(s) for s in segments):
+                return
+            path = self._new_segment_path()
+
+        cutoff = time.time() - self.max_age_seconds
+        offers, vectors, dropped = [], [], set()
+        keep_vectors = all(s.vectors is not None for s in segments)
+        for segment in segments:
+            for offer, vector in segment.iter_docs():
+                if offer.get("indexed_at", 0) < cutoff:
+                    dropped.add(normalize_link(offer.get("link", "")))
+                    continue
+                offers.append(offer)
+                if keep_vectors:
+                    vectors.append(vector)
+
+        # The slow part (reading and writing) happens outside the lock; only the swap is locked
+        if offers:
+            _Segment.write(path, offers, np.vstack(vectors) if keep_vectors and vectors else None)
+        with self._lock:
+            remaining = [s for s in self._segments if s not in segments]
+            self._segments = ([_Segment(path)] if offers else []) + remaining
+            self._known_links -= dropped
+            self._write_manifest()
+        for segment in segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        self.counters.inc("compactions")
+        print(f"OfferIndex: Compacted {len(segments)} segments into one ({len(offers)} offers kept, {len(dropped)} expired)")
+
+    def _has_expired(self, segment: _Segment) -> bool:
+        cutoff = time.time() - self.max_age_seconds
+        return len(segment) > 0 and segment.doc(0).get("indexed_at", 0) < cutoff
+
+    # --- Querying ---
+
+    def lookup(self, specification: Dict[str, Any], limit: int = 10) -> Optional[List[Dict[str, str]]]:
+        """
+        Answer a search from the local index.
+
+        Returns:
+            Ranked offers if at least `min_results` of them clear the confidence
+            threshold, otherwise None (the caller should search upstream)
+        """
+        started = time.monotonic()
+        self.counters.inc("lookups")
+        results = self._lookup(specification, limit)
+        self.lookup_latency.record(time.monotonic() - started)
+        self.counters.inc("hits" if results else "misses")
+        return results
+
+    def _lookup(self, specification: Dict[str, Any], limit: int) -> Optional[List[Dict[str, str]]]:
+        query_weights = build_query_weights(specification or {})
+        name_terms = set(tokenize(str((specification or {}).get("name") or "")))
+        if not query_weights or not name_terms:
+            return None
+
+        with self._lock:
+            sources = list(self._segments) + list(self._flushing) + ([self._live] if len(self._live) else [])
+        if not sources:
+            return None
+
+        candidates = self._score(sources, query_weights, specification, limit * 3)
+        cutoff = time.time() - self.max_age_seconds
+        other_terms = set(query_weights) - name_terms
+        confident = []
+        for offer in candidates:
+            if offer.get("indexed_at", 0) < cutoff:
+                continue
+            tokens = set(_offer_tokens(offer))
+            name_coverage = len(name_terms & tokens) / len(name_terms)
+            other_coverage = len(other_terms & tokens) / len(other_terms) if other_terms else 1.0
+            if 0.7 * name_coverage + 0.3 * other_coverage >= self.confidence_threshold:
+                confident.append({k: offer[k] for k in ("title", "link", "snippet")})
+
+        if len(confident) < self.min_results:
+            return None
+        return rank_options(confident, specification, limit=limit)
+
+    def _score(self, sources: list, query_weights: Dict[str, float],
+               specification: Dict[str, Any], top_k: int) -> List[Dict[str, Any]]:
+        """BM25 over all segments using collection-wide statistics, plus optional cosine similarity."""
+        n_docs = sum(len(s) for s in sources)
+        avg_length = (sum(s.total_length for s in sources) / n_docs) or 1.0
+        doc_freq = {term: sum(len(s.postings_for(term)[0]) for s in sources) for term in query_weights}
+
+        query_vector = None
+        if self.embed_fn:
+            embedded = self._embed([" ".join([str(specification.get("name", ""))] + [str(f) for f in specification.get("features") or []])])
+            query_vector = embedded[0] if embedded is not None else None
+
+        scored: List[Tuple[float, Dict[str, Any]]] = []
+        for source in sources:
+            doc_lengths = np.asarray(source.doc_lengths, dtype=float)
+            scores = np.zeros(len(source))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_length)
+            for term, weight in query_weights.items():
+                doc_ids, tfs = source.postings_for(term)
+                if not len(doc_ids):
+                    continue
+                idf = np.log(1.0 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                tfs = tfs.astype(float)
+                scores[doc_ids] += weight * idf * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+
+            vectors = source.vectors if isinstance(source, _Segment) else source.vector_matrix()
+            if query_vector is not None and vectors is not None and len(vectors) == len(source):
+                # Vectors are unit length, so the dot product is the cosine similarity
+                scores = scores * (1.0 + np.clip(np.asarray(vectors) @ query_vector, 0, 1))
+
+            k = min(top_k, int((scores > 0).sum()))
+            if k == 0:
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            scored.extend((float(scores[i]), source.doc(int(i))) for i in top)
+
+        scored.sort(key=lambda pair: -pair[0])
+        return [offer for _, offer in scored[:top_k]]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Metrics for the /api/metrics endpoint."""
+        return {
+            "offers": self.size,
+            "segments": len(self._segments),
+            "buffered": len(self._live),
+            "lookup_latency": self.lookup_latency.snapshot(),
+            "counters": self.counters.snapshot(),
+        }
+
+    def close(self) -> None:
+        """Flush buffered offers and wait for a running compaction."""
+        self.flush()
+        if self._compaction_thread:
+            self._compaction_thread.join()
@@ -0,0 +1,110 @@
+import asyncio
+import re
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from search_scheduler import PRIORITY_INTERACTIVE
+
+
+def item_key(name: str) -> str:
+    """Normalize a product name so that re-finalizing the same item updates it instead of adding a new one."""
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+
+class LineItem:
+    """One product of a procurement session, with its finalized specification and shopping options."""
+    def __init__(self, item_id: str, specification: Dict[str, Any]):
+        self.item_id = item_id
+        self.specification = specification
+        # None until the item has been searched
+        self.shopping_options: Optional[List[Dict[str, str]]] = None
+        self.error: Optional[str] = None
+        self.finalized_at = datetime.now().isoformat()
+
+    @property
+    def name(self) -> str:
+        return self.specification.get("name", "")
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return "error"
+        return "finalized" if self.shopping_options is None else "searched"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.item_id,
+            "name": self.name,
+            "specification": self.specification,
+            "shoppingOptions": self.shopping_options,
+            "status": self.status,
+        }
+
+
+class ProcurementSession:
+    """
+    Line items of one conversation.
+
+    The procurement agent may finalize several items in one reply, or finalize them one at a
+    time over several turns. Each finalized specification becomes (or replaces) a line item
+    keyed by product name, and the shopping searches of all newly finalized items run
+    concurrently, so a multi-item order takes about as long as its slowest search.
+    """
+    def __init__(self):
+        self.line_items: "OrderedDict[str, LineItem]" = OrderedDict()
+        self._next_id = 1
+
+    def apply_specifications(self, specifications: Iterable[Dict[str, Any]]) -> List[LineItem]:
+        """
+        Add or update line items from finalized specifications.
+
+        A specification for a product that is already a line item replaces it (and its
+        shopping options) unless it is unchanged. Specifications without a name are ignored.
+
+        Returns:
+            The line items that are new or changed and need to be searched
+        """
+        changed: Dict[str, LineItem] = {}
+        for specification in specifications:
+            name = specification.get("name") if isinstance(specification, dict) else None
+            if not name or not isinstance(name, str):
+                continue
+            key = item_key(name)
+            existing = self.line_items.get(key)
+            if existing is not None and existing.specification == specification:
+                continue
+            if existing is not None:
+                item = LineItem(existing.item_id, specification)
+            else:
+                item = LineItem(str(self._next_id), specification)
+                self._next_id += 1
+            self.line_items[key] = item
+            changed[key] = item
+        return list(changed.values())
+
+    async def search(self, shopping_agent: Any, items: List[LineItem], priority: int = PRIORITY_INTERACTIVE) -> None:
+        """
+        Find shopping options for `items` concurrently. A failed search is recorded on its
+        item and does not affect the others.
+        """
+        results = await asyncio.gather(
+            *(shopping_agent.find_options(item.specification, priority=priority) for item in items),
+            return_exceptions=True
+        )
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                print(f"Error searching options for line item '{item.name}': {result}")
+                item.error = str(result)
+                item.shopping_options = []
+            else:
+                item.shopping_options = result or []
+
+    def get(self, name: str) -> Optional[LineItem]:
+        return self.line_items.get(item_key(name)) if isinstance(name, str) else None
+
+    def finalized_names(self) -> List[str]:
+        return [item.name for item in self.line_items.values()]
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [item.to_dict() for item in self.line_items.values()]
@@ -0,0 +1,289 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import LatencyRecorder
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# A single request profile stops sampling after this long, even if the request is still running
+MAX_PROFILE_SECONDS = 120
+PROFILE_HEADER = b"x-profile"
+
+
+def _frame_label(code) -> str:
+    # Last two path components keep labels short but tell e.g. openai/__init__.py from fastapi/__init__.py
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    location = "/".join(path[-2:])
+    return f"{code.co_name} ({location}:{code.co_firstlineno})".replace(";", ",")
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers as a collapsed stack, outermost frame first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Profile:
+    """
+    Stack samples of one thread, aggregated as collapsed stacks (`frame;frame;frame count`),
+    the input format of flamegraph.pl, speedscope and most other flamegraph tools.
+    """
+    def __init__(self, kind: str, label: str, interval: float):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.interval = interval
+        self.started_at = datetime.now().isoformat()
+        self.duration = 0.0
+        self.samples = 0
+        # Samples taken while the loop thread was waiting in select(), i.e. on I/O or timers
+        self.idle_samples = 0
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add_sample(self, frame) -> None:
+        stack = collapse_stack(frame)
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+            if frame.f_code.co_filename.endswith("selectors.py"):
+                self.idle_samples += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.profile_id,
+            "kind": self.kind,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "interval_ms": round(self.interval * 1000, 2),
+        }
+
+
+class ProfileStore:
+    """Ring buffer of the most recent profiles; the oldest one is dropped when it is full."""
+    def __init__(self, max_profiles: int = 50):
+        self._profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return next((p for p in self._profiles if p.profile_id == profile_id), None)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles)
+        return [p.summary() for p in reversed(profiles)]
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+
+class ThreadSampler:
+    """Samples the stack of one thread from a background thread until stopped."""
+    def __init__(self, thread_id: int, profile: Profile, max_seconds: float = MAX_PROFILE_SECONDS):
+        self.thread_id = thread_id
+        self.profile = profile
+        self.max_seconds = max_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        self._thread.join()
+        self.profile.duration = time.perf_counter() - self._started
+        return self.profile
+
+    def _run(self) -> None:
+        deadline = self._started + self.max_seconds
+        while not self._stop.wait(self.profile.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.profile.add_sample(frame)
+
+
+class RequestProfiler:
+    """
+    Decides which requests get a sampling profile of the event loop thread: those that send
+    an `X-Profile: <admin token>` header, and the next requests to a path armed with `arm()`
+    (for callers that cannot send headers, like the WhatsApp webhook).
+    """
+    def __init__(self, store: ProfileStore, is_authorized: Callable[[str], bool],
+                 interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.store = store
+        self.is_authorized = is_authorized
+        self.interval = interval
+        self._armed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def arm(self, path: str, count: int = 1) -> None:
+        """Profile the next `count` requests to `path`."""
+        with self._lock:
+            self._armed[path] = self._armed.get(path, 0) + count
+
+    def armed(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._armed)
+
+    def _take_armed(self, path: str) -> bool:
+        with self._lock:
+            remaining = self._armed.get(path, 0)
+            if not remaining:
+                return False
+            if remaining == 1:
+                del self._armed[path]
+            else:
+                self._armed[path] = remaining - 1
+            return True
+
+    def wants_profile(self, scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == PROFILE_HEADER:
+                if self.is_authorized(value.decode("latin-1").strip()):
+                    return True
+                break
+        return self._take_armed(scope["path"])
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles the requests selected by a RequestProfiler.
+
+    The profile covers the whole request including background tasks that run after the
+    response is sent. Other requests handled by the loop at the same time show up in it too.
+    The profile id is returned in the `X-Profile-Id` response header.
+    """
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile("request", f"{scope['method']} {scope['path']}", self.profiler.interval)
+        sampler = ThreadSampler(threading.get_ident(), profile)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.profile_id.encode())]
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.profiler.store.add(sampler.stop())
+            print(f"Captured profile {profile.profile_id} for {profile.label}: {profile.samples} samples in {profile.duration:.3f}s")
+
+
+class LoopLagMonitor:
+    """
+    Watches the event loop for blocking.
+
+    A heartbeat task on the loop measures how late its timer fires (reported as lag
+    percentiles). A watchdog thread notices when the heartbeat stops for longer than
+    `threshold` and samples the loop thread's stack until the loop is responsive again;
+    the samples of each such block are stored as a "loop_lag" profile.
+    """
+    def __init__(self, store: ProfileStore, threshold: float = 0.2, heartbeat_interval: float = 0.05,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.store = store
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.sample_interval = sample_interval
+        self.lag = LatencyRecorder()
+        self.blocks = 0
+        self._last_beat = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, store: ProfileStore) -> Optional["LoopLagMonitor"]:
+        """Returns None when LOOP_LAG_THRESHOLD_MS is 0 (monitoring disabled)."""
+        threshold_ms = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+        if threshold_ms <= 0:
+            return None
+        return cls(store, threshold=threshold_ms / 1000)
+
+    def start(self) -> None:
+        """Start monitoring the running loop; call from a coroutine on that loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._heartbeat = asyncio.ensure_future(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join()
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.heartbeat_interval
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.perf_counter()
+            self.lag.record(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self) -> None:
+        block: Optional[Profile] = None
+        block_started = 0.0
+        while not self._stop.wait(self.sample_interval if block else self.threshold / 4):
+            now = time.perf_counter()
+            overdue = now - self._last_beat - self.heartbeat_interval
+            if overdue > self.threshold:
+                if block is None:
+                    block = Profile("loop_lag", "event loop blocked", self.sample_interval)
+                    block_started = self._last_beat + self.heartbeat_interval
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    block.add_sample(frame)
+            elif block is not None:
+                block.duration = self._last_beat - block_started
+                self.blocks += 1
+                self.store.add(block)
+                print(f"Event loop was blocked for {block.duration:.3f}s (profile {block.profile_id})")
+                block = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 2),
+            "blocks": self.blocks,
+            "lag": self.lag.snapshot(),
+        }
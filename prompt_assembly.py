@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Optional
+
+from metrics import Counters
+
+
+def assemble_messages(instructions: str, history: Optional[List[Dict[str, str]]], user_message: str,
+                      dynamic_instructions: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Build the message list for one chat completion call.
+
+    The layout keeps the prompt prefix byte-stable from turn to turn so that provider-side
+    prompt caching can reuse it:
+
+        [system: agent instructions]        <- never changes
+        [prior user/assistant turns]        <- only ever grows at the end
+        [system: dynamic instructions]      <- per-turn, not stored in history
+        [user: current message]             <- sent exactly once
+
+    System messages stored in `history` are ignored (the agent instructions are always used as
+    the first message), and `history` itself is never modified.
+
+    Args:
+        instructions: The agent's static system prompt
+        history: Previous messages of the conversation, not including `user_message`
+        user_message: The message to answer
+        dynamic_instructions: Per-turn guidance (product summary, finalize/remember hints)
+
+    Returns:
+        A new list of new message dicts
+    """
+    messages = [{"role": "system", "content": instructions}]
+    for msg in history or []:
+        if msg.get("role") in ("user", "assistant") and msg.get("content"):
+            messages.append({"role": msg["role"], "content": msg["content"]})
+    if dynamic_instructions:
+        messages.append({"role": "system", "content": dynamic_instructions})
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+class TokenUsage:
+    """Token counts for one completion call."""
+    def __init__(self, prompt_tokens: int = 0, cached_tokens: int = 0, completion_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.cached_tokens = cached_tokens
+        self.completion_tokens = completion_tokens
+
+    @classmethod
+    def from_response(cls, response: Any) -> "TokenUsage":
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return cls()
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            prompt_tokens=usage.prompt_tokens or 0,
+            cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+            completion_tokens=usage.completion_tokens or 0,
+        )
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+# Running totals across all turns, reported under "tokens" in /api/metrics
+usage_totals = Counters("turns", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+
+def record_usage(usage: TokenUsage) -> None:
+    usage_totals.inc("turns")
+    usage_totals.inc("prompt_tokens", usage.prompt_tokens)
+    usage_totals.inc("cached_tokens", usage.cached_tokens)
+    usage_totals.inc("completion_tokens", usage.completion_tokens)
+
+
+def usage_snapshot() -> Dict[str, Any]:
+    totals = usage_totals.snapshot()
+    prompt_tokens = totals["prompt_tokens"]
+    totals["cached_ratio"] = round(totals["cached_tokens"] / prompt_tokens, 3) if prompt_tokens else None
+    return totals
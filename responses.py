@@ -0,0 +1,208 @@
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, fall back just in case
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional; without it responses are gzip-compressed only
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed; compression costs more than it saves
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+# --- Response models (the documented shape; payloads are validated against them before sending) ---
+
+class ChatMessageModel(BaseModel):
+    role: str
+    content: str
+    timestamp: Optional[str] = None
+
+
+class ShoppingOptionModel(BaseModel):
+    title: str
+    link: str
+    snippet: str
+
+
+class TokenUsageModel(BaseModel):
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+
+
+class LineItemModel(BaseModel):
+    id: str
+    name: str
+    specification: Dict[str, Any]
+    shoppingOptions: Optional[List[ShoppingOptionModel]] = None
+    status: str
+
+
+class ChatResponse(BaseModel):
+    conversation_id: str
+    response: str
+    productSpecification: Optional[Dict[str, Any]] = None
+    isSpecificationFinalized: bool
+    messages: List[ChatMessageModel]
+    shoppingOptions: Optional[List[ShoppingOptionModel]] = None
+    lineItems: List[LineItemModel] = []
+    usage: Optional[TokenUsageModel] = None
+
+
+class ConversationResponse(BaseModel):
+    conversation_id: str
+    messages: List[ChatMessageModel]
+
+
+# --- Serialization and compression ---
+
+def dumps(payload: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick a content encoding from an Accept-Encoding header: "br" if brotli is installed and
+    accepted, else "gzip", else None. Encodings with q=0 are treated as refused.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+
+    def allowed(name: str) -> bool:
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def encoded_response(request: Request, body: bytes, status_code: int = 200,
+                     compressed: Optional[Callable[[str], bytes]] = None) -> Response:
+    """
+    Build a JSON Response from serialized bytes, compressing it when the client accepts it
+    and the body is large enough.
+
+    Args:
+        request: The incoming request (for Accept-Encoding)
+        body: Serialized JSON
+        status_code: HTTP status
+        compressed: Optional function returning the body compressed with a given encoding
+            (used to serve pre-compressed bytes from a cache)
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESSION_MIN_SIZE else None
+    if encoding:
+        body = compressed(encoding) if compressed else compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def json_response(request: Request, payload: Any, status_code: int = 200) -> Response:
+    """Serialize `payload` with the fast encoder and return a (possibly compressed) Response."""
+    return encoded_response(request, dumps(payload), status_code)
+
+
+def model_response(request: Request, model: Type[BaseModel], payload: Any, status_code: int = 200) -> Response:
+    """
+    Validate `payload` against a response model and send the validated data, so that what
+    goes over the wire is exactly the documented schema (unknown fields are dropped).
+
+    Raises:
+        pydantic.ValidationError: If the payload does not match the model
+    """
+    return json_response(request, validated(model, payload), status_code)
+
+
+def validated(model: Type[BaseModel], payload: Any) -> Dict[str, Any]:
+    """The payload as validated by `model`, ready to be serialized."""
+    return model.model_validate(payload).model_dump()
+
+
+class SnapshotCache:
+    """
+    LRU cache of serialized (and lazily compressed) response bodies keyed by an id and a
+    version. A request for the same id and version is served from the cached bytes; a new
+    version replaces the old entry.
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, bytes, Dict[str, bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def response(self, request: Request, key: str, version: Any, build: Callable[[], Any]) -> Response:
+        """
+        Return the response for `key` at `version`, calling `build()` for the payload only
+        when the cached bytes are missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+
+        if entry is None:
+            self.misses += 1
+            entry = (version, dumps(build()), {})
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        _, body, compressed_bodies = entry
+
+        def cached_compress(encoding: str) -> bytes:
+            if encoding not in compressed_bodies:
+                compressed_bodies[encoding] = compress(body, encoding)
+            return compressed_bodies[encoding]
+
+        return encoded_response(request, body, compressed=cached_compress)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
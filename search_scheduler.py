@@ -0,0 +1,287 @@
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import Counters, LatencyRecorder
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_PREFETCH = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK: "bulk",
+    PRIORITY_PREFETCH: "prefetch",
+}
+
+# Fraction of the daily budget that must still be left for a priority class to be admitted.
+# Interactive chat may use the budget down to zero; bulk and prefetch traffic stop earlier so
+# that there is always quota left for people waiting on a chat response.
+DEFAULT_RESERVES = {
+    PRIORITY_INTERACTIVE: 0.0,
+    PRIORITY_BULK: 0.2,
+    PRIORITY_PREFETCH: 0.5,
+}
+
+
+class QuotaExceededError(Exception):
+    """Raised by a search call when the upstream reports that the quota is used up."""
+
+
+def _quota_day() -> str:
+    # Google resets Custom Search quotas at midnight Pacific Time
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+    except Exception:
+        return datetime.now(timezone.utc).date().isoformat()
+
+
+class DailyBudget:
+    """
+    Counts searches made today and persists the counter to disk so that it survives restarts.
+    """
+    def __init__(self, limit: int, state_path: Optional[str] = None):
+        self.limit = limit
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._day = _quota_day()
+        self._used = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("day") == self._day:
+                self._used = int(state.get("used", 0))
+        except (OSError, ValueError) as e:
+            print(f"SearchScheduler: Could not read quota state from {self.state_path}: {e}")
+
+    def _save(self) -> None:
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"day": self._day, "used": self._used, "limit": self.limit}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"SearchScheduler: Could not persist quota state to {self.state_path}: {e}")
+
+    def _roll_over(self) -> None:
+        today = _quota_day()
+        if today != self._day:
+            self._day = today
+            self._used = 0
+
+    @property
+    def used(self) -> int:
+        with self._lock:
+            self._roll_over()
+            return self._used
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            self._roll_over()
+            return max(0, self.limit - self._used)
+
+    def try_consume(self, reserve: int = 0) -> bool:
+        """Take one unit of budget if more than `reserve` units would remain available."""
+        with self._lock:
+            self._roll_over()
+            if self.limit - self._used <= reserve:
+                return False
+            self._used += 1
+            self._save()
+            return True
+
+    def exhaust(self) -> None:
+        """Mark the budget as used up for the rest of the day (upstream said so)."""
+        with self._lock:
+            self._roll_over()
+            self._used = max(self._used, self.limit)
+            self._save()
+
+
+class _ResultCache:
+    """Small LRU cache of search results keyed by query."""
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[List[Dict[str, str]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, results = entry
+        if not allow_stale and time.monotonic() - stored_at > self.ttl_seconds:
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def put(self, key: str, results: List[Dict[str, str]]) -> None:
+        self._entries[key] = (time.monotonic(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SearchScheduler:
+    """
+    Schedules upstream search calls against a daily quota and a per-second rate limit.
+
+    Requests are served from cache when possible; otherwise they are queued by priority
+    (interactive before bulk before prefetch) and dispatched by a small pool of workers.
+    When the remaining budget drops below a priority's reserve, that request is not sent
+    upstream and is answered from (possibly stale) cache instead.
+    """
+    def __init__(self, daily_limit: int = 100, max_per_second: float = 5.0,
+                 max_concurrent: int = 4, state_path: Optional[str] = None,
+                 cache_ttl_seconds: float = 24 * 3600, cache_max_entries: int = 1000,
+                 reserves: Optional[Dict[int, float]] = None):
+        self.budget = DailyBudget(daily_limit, state_path)
+        self.min_interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self.max_concurrent = max(1, max_concurrent)
+        self.reserves = reserves or DEFAULT_RESERVES
+        self.cache = _ResultCache(cache_max_entries, cache_ttl_seconds)
+
+        self._sequence = itertools.count()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_slot = 0.0
+
+        self.queue_wait = {priority: LatencyRecorder() for priority in PRIORITY_NAMES}
+        self.counters = Counters("requests", "cache_hits", "upstream_calls", "degraded", "quota_exceeded", "errors")
+
+    @classmethod
+    def from_env(cls) -> "SearchScheduler":
+        return cls(
+            daily_limit=int(os.getenv("GOOGLE_SEARCH_DAILY_QUOTA", "100")),
+            max_per_second=float(os.getenv("GOOGLE_SEARCH_MAX_QPS", "5")),
+            state_path=os.getenv("SEARCH_QUOTA_STATE_PATH", ".search_quota.json"),
+        )
+
+    def _reserve_units(self, priority: int) -> int:
+        return int(self.budget.limit * self.reserves.get(priority, 0.0))
+
+    def _ensure_workers(self) -> None:
+        loop = asyncio.get_event_loop()
+        if self._loop is loop and self._workers:
+            return
+        # First use, or we are running under a different event loop (e.g. the bulk CLI)
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.max_concurrent)]
+
+    async def search(self, key: str, fetch: Callable[[], Awaitable[List[Dict[str, str]]]],
+                     priority: int = PRIORITY_INTERACTIVE) -> List[Dict[str, str]]:
+        """
+        Return results for `key`, calling `fetch` upstream only if the cache cannot answer and
+        the budget admits a request of this priority.
+
+        Errors raised by `fetch` (other than QuotaExceededError) are propagated to the caller.
+        """
+        self.counters.inc("requests")
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.counters.inc("cache_hits")
+            return cached
+
+        if self.budget.remaining <= self._reserve_units(priority):
+            return self._degrade(key, priority)
+
+        self._ensure_workers()
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((priority, next(self._sequence), time.monotonic(), key, fetch, future))
+        return await future
+
+    def _degrade(self, key: str, priority: int) -> List[Dict[str, str]]:
+        self.counters.inc("degraded")
+        stale = self.cache.get(key, allow_stale=True)
+        print(f"SearchScheduler: Budget low ({self.budget.remaining} left), serving {PRIORITY_NAMES.get(priority, priority)} request from "
+              f"{'stale cache' if stale is not None else 'empty result'}")
+        return stale if stale is not None else []
+
+    async def _wait_for_slot(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _worker(self) -> None:
+        while True:
+            priority, _, enqueued_at, key, fetch, future = await self._queue.get()
+            try:
+                if future.done():
+                    continue
+                self.queue_wait[priority].record(time.monotonic() - enqueued_at)
+
+                # Another request may have filled the cache while this one was queued
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.counters.inc("cache_hits")
+                    future.set_result(cached)
+                    continue
+
+                # Budget is re-checked at dispatch time since it may have dropped while queued
+                if not self.budget.try_consume(reserve=self._reserve_units(priority)):
+                    future.set_result(self._degrade(key, priority))
+                    continue
+
+                await self._wait_for_slot()
+                self.counters.inc("upstream_calls")
+                try:
+                    results = await fetch()
+                except QuotaExceededError:
+                    self.counters.inc("quota_exceeded")
+                    self.budget.exhaust()
+                    future.set_result(self._degrade(key, priority))
+                    continue
+                except Exception as e:
+                    self.counters.inc("errors")
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+
+                self.cache.put(key, results)
+                if not future.done():
+                    future.set_result(results)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                print(f"SearchScheduler: Unexpected worker error: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Metrics for the /api/metrics endpoint."""
+        return {
+            "daily_limit": self.budget.limit,
+            "used_today": self.budget.used,
+            "remaining_quota": self.budget.remaining,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "cached_queries": len(self.cache),
+            "queue_wait": {PRIORITY_NAMES[p]: recorder.snapshot() for p, recorder in self.queue_wait.items()},
+            "counters": self.counters.snapshot(),
+        }
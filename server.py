@@ -1,15 +1,25 @@
 from fastapi import FastAPI, HTTPException, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
 # Import both agents
-from custom_agents import Agent as ProcurementAgentImpl, Runner  # Renamed to avoid conflict
 from ai_agent_service import ProcurementAgent # This wraps the implementation
 from shopping_agent import ShoppingAgent
+from custom_agents import get_openai_caller
+from prompt_assembly import usage_snapshot
+from responses import ChatResponse, ConversationResponse, SnapshotCache, model_response, validated
+from whatsapp_ingest import has_messages, verify_signature, webhook_counters
+from admission import AdmissionController, AdmissionRejected
+from bulk_procurement import BulkProcurementRunner, DEFAULT_CONCURRENCY, DEFAULT_MAX_ITEMS, aiter_lines, aiter_spooled, limit_items, parse_items, spool_body, stream_ndjson
+from procurement_session import ProcurementSession
+from profiling import LoopLagMonitor, ProfileStore, ProfilingMiddleware, RequestProfiler
+from conversation_export import EXPORT_FORMATS, FILE_EXTENSIONS, MEDIA_TYPES, ExportFormatUnavailable, iter_export_rows, normalize_timestamp, stream_export
 import uvicorn
-import asyncio
-import nest_asyncio
 from typing import Optional, List, Dict, Any
 import uuid
+import asyncio
 from datetime import datetime
 import httpx
 import os
@@ -18,16 +28,78 @@ import hmac
 import hashlib
 import base64
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
+# Agents, limits and WhatsApp settings are created in lifespan() rather than at import time,
+# so that importing this module stays cheap and the environment is loaded first
+procurement_agent_service: Optional[ProcurementAgent] = None
+shopping_agent: Optional[ShoppingAgent] = None
+# Bounds concurrent agent turns across web chat and WhatsApp
+admission_controller: Optional[AdmissionController] = None
 
-app = FastAPI()
-# Instantiate both agents
-procurement_agent_service = ProcurementAgent() # Keep using the service wrapper
-shopping_agent = ShoppingAgent()
+# WhatsApp configuration
+WHATSAPP_VERIFY_TOKEN = None
+WHATSAPP_ACCESS_TOKEN = None
+WHATSAPP_API_VERSION = "v19.0"
+PHONE_NUMBER_ID = None
+# App secret used to verify the x-hub-signature-256 header on webhook calls
+WHATSAPP_APP_SECRET = None
+# Bearer token for admin endpoints (exports, profiles); they are disabled while it is unset
+ADMIN_API_TOKEN = None
+# Line items accepted per bulk upload
+BULK_MAX_ITEMS = DEFAULT_MAX_ITEMS
+# Records stack samples of the event loop while it is blocked (None if disabled)
+loop_monitor: Optional[LoopLagMonitor] = None
+
+async def warm_up_openai_client():
+    try:
+        await asyncio.to_thread(procurement_agent_service.agent.warm_up)
+    except Exception as e:
+        # The client is created on first use instead
+        print(f"OpenAI client warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global procurement_agent_service, shopping_agent, admission_controller
+    global WHATSAPP_VERIFY_TOKEN, WHATSAPP_ACCESS_TOKEN, PHONE_NUMBER_ID, WHATSAPP_APP_SECRET, ADMIN_API_TOKEN, BULK_MAX_ITEMS, loop_monitor
+
+    load_dotenv()
+    WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
+    WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
+    PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+    WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
+    if not WHATSAPP_APP_SECRET:
+        print("WARNING: WHATSAPP_APP_SECRET not set; WhatsApp webhook signatures will not be verified.")
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+    BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", str(DEFAULT_MAX_ITEMS)))
+
+    # Instantiate both agents
+    procurement_agent_service = ProcurementAgent() # Keep using the service wrapper
+    shopping_agent = ShoppingAgent()
+    admission_controller = AdmissionController.from_env()
+    # Import openai and create its client in a thread once the server is up: readiness does not
+    # wait for it, and a chat turn arriving after the warm-up does not pay for it either
+    warm_up = asyncio.create_task(warm_up_openai_client())
+    # Same for the offer index, which reads every stored offer when it is opened
+    offer_index_loading = asyncio.ensure_future(shopping_agent.load_offer_index())
+
+    request_profiler.interval = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+    loop_monitor = LoopLagMonitor.from_env(profile_store)
+    if loop_monitor:
+        loop_monitor.start()
+
+    yield
+
+    await warm_up
+    await offer_index_loading
+    if loop_monitor:
+        await loop_monitor.stop()
+    shopping_agent.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # In-memory conversations store (use a database in production)
 conversations = {}
+# Serialized GET /api/conversations/{id} bodies, reused until the conversation changes
+conversation_snapshots = SnapshotCache()
 
 # Configure CORS
 app.add_middleware(
@@ -41,11 +113,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# WhatsApp configuration
-WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
-WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
-WHATSAPP_API_VERSION = "v19.0"
-PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+def is_admin_token(token: str) -> bool:
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+# Request and event loop profiles, most recent last
+profile_store = ProfileStore()
+# Profiles requests sent with `X-Profile: <ADMIN_API_TOKEN>` or armed via /api/admin/profiles/arm
+request_profiler = RequestProfiler(profile_store, is_admin_token)
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
 
 # WhatsApp Models
 class WhatsAppChangeValue(BaseModel):
@@ -90,17 +165,32 @@ async def verify_webhook(request: Request):
 
 # WhatsApp Webhook Handler
 @app.post("/webhook/whatsapp")
-async def handle_whatsapp_message(payload: WhatsAppWebhookPayload, background_tasks: BackgroundTasks):
+async def handle_whatsapp_message(request: Request, background_tasks: BackgroundTasks):
     """Handles incoming messages from WhatsApp."""
+    raw_body = await request.body()
+    webhook_counters.inc("received")
+
+    # Verify webhook signature (security) on the exact bytes Meta signed
+    if WHATSAPP_APP_SECRET and not verify_signature(raw_body, request.headers.get("x-hub-signature-256"), WHATSAPP_APP_SECRET):
+        webhook_counters.inc("invalid_signature")
+        print("Rejected WhatsApp notification with invalid signature")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+    # Most callbacks are delivery/read statuses - acknowledge them without building models
+    if not has_messages(raw_body):
+        webhook_counters.inc("status_only")
+        return Response(content="EVENT_RECEIVED", status_code=200)
+
     print("Received WhatsApp notification")
+    webhook_counters.inc("messages")
+    try:
+        payload = WhatsAppWebhookPayload.model_validate_json(raw_body)
+    except ValidationError as e:
+        webhook_counters.inc("invalid_payload")
+        print(f"Invalid WhatsApp webhook payload: {e}")
+        raise HTTPException(status_code=422, detail="Invalid webhook payload")
     
     try:
-        # Verify webhook signature (security)
-        # This is a placeholder - implement proper signature verification in production
-        # signature = request.headers.get("x-hub-signature-256")
-        # if not verify_signature(signature, await request.body()):
-        #     raise HTTPException(status_code=403, detail="Invalid signature")
-
         for entry in payload.entry:
             for change in entry.changes:
                 if change.field == "messages" and change.value.messages:
@@ -152,8 +242,48 @@ async def send_whatsapp_message(recipient_wa_id: str, message_text: str):
     except Exception as e:
         print(f"Unexpected error sending WhatsApp message: {e}")
 
+def record_turn(conversation_id: str, user_message: str, assistant_message: str):
+    """Appends an answered turn to the conversation's message list."""
+    conversation = conversations[conversation_id]
+    conversation['messages'].append({
+        'role': 'user',
+        'content': user_message,
+        'timestamp': datetime.now().isoformat()
+    })
+    now = datetime.now().isoformat()
+    conversation['messages'].append({
+        'role': 'assistant',
+        'content': assistant_message,
+        'timestamp': now
+    })
+    conversation['updated_at'] = now
+
+def get_session(conversation_id: str) -> ProcurementSession:
+    """The conversation's line items (created on first use, e.g. for conversations restored from a client cache)."""
+    return conversations[conversation_id].setdefault('session', ProcurementSession())
+
+def record_finalized_specification(conversation_id: str, specification: Dict[str, Any], shopping_options: Optional[List[Dict[str, str]]]):
+    """Keeps finalized specifications and their shopping options for exports."""
+    conversation = conversations[conversation_id]
+    now = datetime.now().isoformat()
+    conversation.setdefault('specifications', []).append({
+        'specification': specification,
+        'shopping_options': shopping_options or [],
+        'finalized_at': now
+    })
+    conversation['updated_at'] = now
+
 # WhatsApp Message Processor
 async def process_incoming_whatsapp_message(sender_wa_id: str, user_message: str):
+    """Admits an incoming WhatsApp message and processes it, or tells the sender we're busy."""
+    try:
+        async with admission_controller.admit(f"wa:{sender_wa_id}"):
+            await process_whatsapp_turn(sender_wa_id, user_message)
+    except AdmissionRejected as e:
+        print(f"Rejected WhatsApp message from {sender_wa_id}: {e.reason}")
+        await send_whatsapp_message(sender_wa_id, "Sorry, I'm handling a lot of requests right now. Please send your message again in a minute.")
+
+async def process_whatsapp_turn(sender_wa_id: str, user_message: str):
     """Processes incoming WhatsApp message through AI agents and sends response."""
     print(f"Processing message for {sender_wa_id}: '{user_message}'")
 
@@ -169,22 +299,35 @@ async def process_incoming_whatsapp_message(sender_wa_id: str, user_message: str
 
     try:
         # Process with Procurement Agent
-        procurement_result = procurement_agent_service.process_message(
+        session = get_session(conversation_id)
+        procurement_result = await procurement_agent_service.process_message(
             user_message,
-            current_chat_history
+            current_chat_history,
+            finalized_items=session.finalized_names()
         )
-        ai_response_text = procurement_result["message"]
-        final_specification = procurement_result["specification"]
         conversations[conversation_id]['chat_history'] = procurement_result['history']
+        if not procurement_result["success"]:
+            print(f"Procurement agent failed for {sender_wa_id}: {procurement_result['message']}")
+            await send_whatsapp_message(sender_wa_id, "Sorry, I'm having trouble reaching the AI service right now. Please try again in a few minutes.")
+            return
+        ai_response_text = procurement_result["message"]
+        record_turn(conversation_id, user_message, ai_response_text)
 
-        # If specification is finalized, call Shopping Agent
+        # Search for every line item finalized in this turn at once
         shopping_options_text = ""
-        if final_specification:
-            print(f"Specification finalized for {sender_wa_id}, calling Shopping Agent...")
-            shopping_options = await shopping_agent.find_options(final_specification)
-            if shopping_options:
-                shopping_options_text = "\n\nHere are some shopping options I found:"
-                for option in shopping_options[:3]:
+        finalized_items = session.apply_specifications(procurement_result["specifications"])
+        if finalized_items:
+            print(f"{len(finalized_items)} line item(s) finalized for {sender_wa_id}, calling Shopping Agent...")
+            await session.search(shopping_agent, finalized_items)
+            for item in finalized_items:
+                record_finalized_specification(conversation_id, item.specification, item.shopping_options)
+                if not item.shopping_options:
+                    continue
+                if len(finalized_items) == 1:
+                    shopping_options_text += "\n\nHere are some shopping options I found:"
+                else:
+                    shopping_options_text += f"\n\nShopping options for {item.name}:"
+                for option in item.shopping_options[:3]:
                     shopping_options_text += f"\n- {option['title']}: {option['link']}"
 
         # Combine responses
@@ -197,11 +340,40 @@ async def process_incoming_whatsapp_message(sender_wa_id: str, user_message: str
         print(f"Error processing AI response for {sender_wa_id}: {e}")
         await send_whatsapp_message(sender_wa_id, "Sorry, I encountered an error processing your request.")
 
-@app.post("/api/chat")
-async def chat(message: Message):
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(message: Message, request: Request):
+    # Turns are limited per conversation. New (or unknown) conversations get their id here,
+    # so that each one has its own admission key and only the global limit applies across them;
+    # client addresses are not usable as keys behind the reverse proxy.
+    conversation_id = message.conversation_id if message.conversation_id in conversations else str(uuid.uuid4())
+    admission_key = f"chat:{conversation_id}"
+    try:
+        async with admission_controller.admit(admission_key):
+            response_payload = await process_chat_turn(message, conversation_id)
+    except AdmissionRejected as e:
+        print(f"Rejected chat turn for {admission_key}: {e.reason}")
+        raise HTTPException(
+            status_code=429,
+            detail="The assistant is busy right now, please try again shortly.",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    return model_response(request, ChatResponse, response_payload)
+
+def restored_messages(cached_messages: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Messages from a client cache, reduced to the fields (and values) of ChatMessageModel."""
+    restored = []
+    for msg in cached_messages or []:
+        if isinstance(msg.get("role"), str) and isinstance(msg.get("content"), str):
+            timestamp = msg.get("timestamp")
+            restored.append({
+                'role': msg["role"],
+                'content': msg["content"],
+                'timestamp': timestamp if isinstance(timestamp, str) else None
+            })
+    return restored
+
+async def process_chat_turn(message: Message, conversation_id: str):
     try:
-        conversation_id = message.conversation_id
-        
         # Debug logging
         print(f"Received message: {message.message}")
         print(f"Conversation ID: {conversation_id}")
@@ -229,8 +401,7 @@ async def chat(message: Message):
             print(f"Converted {len(converted_messages)} messages from cache")
         
         # Create new conversation if ID doesn't exist
-        if not conversation_id or conversation_id not in conversations:
-            conversation_id = str(uuid.uuid4())
+        if conversation_id not in conversations:
             print(f"Creating new conversation with ID: {conversation_id}")
             
             initial_chat_history = converted_messages if converted_messages else [
@@ -241,7 +412,7 @@ async def chat(message: Message):
             ]
             
             conversations[conversation_id] = {
-                'messages': message.cached_messages.copy() if message.cached_messages else [],
+                'messages': restored_messages(message.cached_messages),
                 'chat_history': initial_chat_history,
                 'created_at': datetime.now().isoformat(),
                 'restored_from_cache': bool(converted_messages)
@@ -256,44 +427,42 @@ async def chat(message: Message):
         current_chat_history = conversations[conversation_id]['chat_history']
         print(f"Chat history length before processing: {len(current_chat_history)}")
         
+        session = get_session(conversation_id)
+
         # === Step 1: Process message with Procurement Agent ===
-        procurement_result = procurement_agent_service.process_message(
+        procurement_result = await procurement_agent_service.process_message(
             message.message,
-            current_chat_history
+            current_chat_history,
+            finalized_items=session.finalized_names()
         )
         
         # Update the conversation history with the procurement agent's result
         conversations[conversation_id]['chat_history'] = procurement_result['history']
+        if not procurement_result["success"]:
+            # Surface upstream outages as a proper error instead of an assistant message
+            status_code = 503 if procurement_result.get("upstream_unavailable") else 500
+            raise HTTPException(status_code=status_code, detail=procurement_result["message"])
         
         # Add user message and procurement agent response to messages list for frontend
-        conversations[conversation_id]['messages'].append({
-            'role': 'user',
-            'content': message.message,
-            'timestamp': datetime.now().isoformat()
-        })
-        conversations[conversation_id]['messages'].append({
-            'role': 'assistant',
-            'content': procurement_result['message'],
-            'timestamp': datetime.now().isoformat()
-        })
+        record_turn(conversation_id, message.message, procurement_result['message'])
         
-        # === Step 2: If specification finalized, call Shopping Agent ===
+        # === Step 2: Search for all line items finalized in this turn, concurrently ===
+        finalized_items = session.apply_specifications(procurement_result["specifications"])
+        if finalized_items:
+            print(f"Procurement agent finalized {len(finalized_items)} line item(s). Calling Shopping Agent.")
+            await session.search(shopping_agent, finalized_items)
+            for item in finalized_items:
+                print(f"Shopping agent returned {len(item.shopping_options)} options for '{item.name}'.")
+                record_finalized_specification(conversation_id, item.specification, item.shopping_options)
+
+        # The first specification of the reply is still reported on its own for existing clients
         shopping_options = None
         final_specification = procurement_result["specification"]
-        
         if final_specification:
-            print(f"Procurement agent finalized specification. Calling Shopping Agent.")
-            try:
-                # Call the shopping agent asynchronously
-                shopping_options = await shopping_agent.find_options(final_specification)
-                print(f"Shopping agent returned {len(shopping_options) if shopping_options else 0} options.")
-            except Exception as shop_e:
-                print(f"Error calling Shopping Agent: {shop_e}")
-                # Optionally add an error message for the user
-                # procurement_result["message"] += "\n(Could not search for shopping options due to an error.)"
+            item = session.get(final_specification.get("name"))
+            shopping_options = item.shopping_options if item else None
 
         # === Step 3: Prepare response for frontend ===
-        print(f"Product extraction from agent: {procurement_agent_service.current_product}")
         print(f"Chat history length after processing: {len(conversations[conversation_id]['chat_history'])}")
         print(f"Response message: {procurement_result['message'][:50]}...")
         
@@ -304,25 +473,149 @@ async def chat(message: Message):
             "isSpecificationFinalized": bool(final_specification),
             "messages": conversations[conversation_id]['messages'],
             # Add shopping options if they exist
-            "shoppingOptions": shopping_options 
+            "shoppingOptions": shopping_options,
+            # Every line item of the conversation with its specification and shopping options
+            "lineItems": session.to_list(),
+            # Prompt, cached and completion tokens for this turn
+            "usage": procurement_result.get("usage")
         }
         
         return response_payload
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error in chat endpoint: {str(e)}")
         traceback.print_exc() # Print full traceback for debugging
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str):
+@app.get("/api/conversations/{conversation_id}", response_model=ConversationResponse)
+async def get_conversation(conversation_id: str, request: Request):
     if conversation_id not in conversations:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
+    # Messages are only ever appended, so their count identifies the snapshot
+    messages = conversations[conversation_id]['messages']
+    return conversation_snapshots.response(
+        request,
+        conversation_id,
+        len(messages),
+        lambda: validated(ConversationResponse, {
+            "conversation_id": conversation_id,
+            "messages": messages,
+        })
+    )
+
+def require_admin(request: Request):
+    """Rejects the request unless it carries `Authorization: Bearer <ADMIN_API_TOKEN>`."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_API_TOKEN is not set)")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not is_admin_token(token.strip()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/api/bulk/specifications")
+async def bulk_specifications(request: Request, format: Optional[str] = None, concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Generates finalized specifications and shopping options for a CSV or JSONL upload of
+    line items. The body is spooled to a temporary file (it cannot be read once the
+    streaming response has started) and results are streamed back as NDJSON in completion
+    order, so neither side has to hold the whole file in memory.
+
+    Admin only: every item costs an agent turn and a shopping search. At most BULK_MAX_ITEMS
+    items are processed per upload.
+    """
+    require_admin(request)
+    input_format = format
+    if not input_format:
+        content_type = request.headers.get("content-type", "")
+        input_format = "csv" if "csv" in content_type else "jsonl"
+    if input_format not in ("csv", "jsonl", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {input_format}")
+    if concurrency < 1 or concurrency > 32:
+        raise HTTPException(status_code=400, detail="concurrency must be between 1 and 32")
+
+    run_id = uuid.uuid4().hex[:12]
+    print(f"Starting bulk specification run {run_id} (format={input_format}, concurrency={concurrency})")
+    runner = BulkProcurementRunner(shopping_agent, concurrency=concurrency,
+                                   admission=admission_controller, admission_key=f"bulk:{run_id}")
+    spool = await spool_body(request.stream())
+    items = limit_items(parse_items(aiter_lines(aiter_spooled(spool)), input_format), BULK_MAX_ITEMS)
+    return StreamingResponse(stream_ndjson(runner.run(items)), media_type="application/x-ndjson")
+
+@app.get("/api/export")
+async def export_conversations(request: Request, format: str = "ndjson", since: Optional[str] = None):
+    """
+    Streams messages, finalized specifications and shopping options of all conversations as
+    NDJSON, an Arrow IPC stream or Parquet. Rows are produced batch by batch while the store
+    is walked, so memory use stays bounded however many conversations there are.
+
+    Pass the returned `X-Export-Until` value as `since` on the next call to export only
+    what was added in between.
+    """
+    require_admin(request)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    try:
+        since = normalize_timestamp(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be an ISO 8601 timestamp")
+
+    until = datetime.now().isoformat()
+    try:
+        chunks = stream_export(iter_export_rows(conversations, since, until), format)
+    except ExportFormatUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    print(f"Starting {format} export (since={since}, until={until})")
+    filename = f"conversations-{until.replace(':', '')}.{FILE_EXTENSIONS[format]}"
+    # A sync iterator: Starlette runs it in the threadpool, keeping encoding off the event loop
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers={
+        "X-Export-Until": until,
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+
+@app.get("/api/admin/profiles")
+async def list_profiles(request: Request):
+    """Lists the captured request and event loop profiles, newest first."""
+    require_admin(request)
+    return {
+        "profiles": profile_store.list(),
+        "armed": request_profiler.armed(),
+        "loop_lag": loop_monitor.snapshot() if loop_monitor else None,
+    }
+
+@app.post("/api/admin/profiles/arm")
+async def arm_profiling(request: Request, path: str, count: int = 1):
+    """Profiles the next `count` requests to `path` (e.g. /webhook/whatsapp, which cannot send X-Profile)."""
+    require_admin(request)
+    if count < 1 or count > 100:
+        raise HTTPException(status_code=400, detail="count must be between 1 and 100")
+    request_profiler.arm(path, count)
+    return {"armed": request_profiler.armed()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Returns a profile as collapsed stacks, ready for flamegraph.pl or speedscope."""
+    require_admin(request)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Operational metrics (admission, search quota, queue waits, LLM resilience) for dashboards and alerting."""
     return {
-        "conversation_id": conversation_id,
-        "messages": conversations[conversation_id]['messages'],
+        "admission": admission_controller.snapshot(),
+        "openai": get_openai_caller().snapshot(),
+        "tokens": usage_snapshot(),
+        "webhook": webhook_counters.snapshot(),
+        "conversation_snapshots": conversation_snapshots.snapshot(),
+        "search": shopping_agent.scheduler.snapshot(),
+        "offer_index": shopping_agent.offer_index.snapshot() if shopping_agent.offer_index else None,
+        "loop_lag": loop_monitor.snapshot() if loop_monitor else None,
     }
 
 # Removed check-api-key endpoint as it was not fully implemented
@@ -1,12 +1,13 @@
+import asyncio
 import os
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import httpx # Using httpx for async requests, install with: pip install httpx
-from googleapiclient.errors import HttpError
+from search_scheduler import SearchScheduler, QuotaExceededError, PRIORITY_INTERACTIVE
 
-# Note: googleapiclient doesn't directly support async, so we'll use httpx
-# for the actual HTTP call to the REST endpoint. You still need google-api-python-client
-# installed for potential future use or other Google APIs, but we won't build the service object here.
+# Note: we call the Custom Search REST endpoint directly with httpx since googleapiclient
+# doesn't support async. The ranking and offer index modules pull in NumPy, so they are
+# imported on first use to keep startup fast.
 
 class ShoppingAgent:
     def __init__(self):
@@ -21,24 +22,67 @@ class ShoppingAgent:
             print("ShoppingAgent initialized with Google Search credentials.")
         
         self.base_url = "https://www.googleapis.com/customsearch/v1"
+        # Keeps upstream calls within the daily quota and per-second limits
+        self.scheduler = SearchScheduler.from_env()
+        self._offer_index = None
+        self._offer_index_loading: Optional[asyncio.Future] = None
 
-    async def find_options(self, specification: Dict[str, Any]) -> List[Dict[str, str]]:
+    @property
+    def offer_index(self):
+        """
+        Local index of previously seen offers; answers confident matches without calling Google.
+        None until load_offer_index() has finished (or when the index is disabled).
+        """
+        return self._offer_index
+
+    async def load_offer_index(self):
+        """
+        Load the offer index in a worker thread (once; concurrent callers share the load).
+        Opening it reads every stored offer, which must not hold up the event loop.
+        """
+        if self._offer_index_loading is None:
+            self._offer_index_loading = asyncio.ensure_future(asyncio.to_thread(self._open_offer_index))
+        return await asyncio.shield(self._offer_index_loading)
+
+    def _open_offer_index(self):
+        from offer_index import OfferIndex
+        try:
+            self._offer_index = OfferIndex.from_env()
+        except Exception as e:
+            print(f"ShoppingAgent: Could not open the offer index, searching without it: {e}")
+        return self._offer_index
+
+    def close(self) -> None:
+        """Persist offers that are still buffered in memory."""
+        if self._offer_index:
+            self._offer_index.close()
+
+    async def find_options(self, specification: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> List[Dict[str, str]]:
         """
         Takes a product specification and searches the web for purchasing options
         using Google Custom Search JSON API.
 
         Args:
             specification: A dictionary containing the product details.
+            priority: Scheduling priority (interactive chat, bulk or prefetch traffic).
 
         Returns:
-            A list of potential shopping options.
+            A list of potential shopping options, best match first.
         """
+        if not specification or not specification.get("name"):
+            return []
+
+        # --- Try the local offer index first ---
+        offer_index = await self.load_offer_index()
+        if offer_index:
+            local_results = offer_index.lookup(specification)
+            if local_results:
+                print(f"ShoppingAgent: Served {len(local_results)} options for '{specification['name']}' from the local offer index.")
+                return local_results
+
         if not self.search_api_key or not self.search_engine_id:
             print("ShoppingAgent: Cannot search, API key or Search Engine ID missing.")
             return []
-        
-        if not specification or not specification.get("name"):
-            return []
 
         product_name = specification["name"]
         features = specification.get("features", [])
@@ -51,43 +95,88 @@ class ShoppingAgent:
             query += f" {' '.join(features[:2])}"
         print(f"ShoppingAgent: Using search query: '{query}'")
 
-        # --- Prepare API Request --- 
-        params = {
-            'key': self.search_api_key,
-            'cx': self.search_engine_id,
-            'q': query,
-            'num': 5 # Requesting top 5 results, adjust as needed
-        }
-
-        # --- Call Google Custom Search API using httpx --- 
-        results = []
+        # --- Schedule the search against the daily quota ---
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(self.base_url, params=params)
-                response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-                search_data = response.json()
-
-            # --- Parse Results --- 
-            if search_data and 'items' in search_data:
-                for item in search_data['items']:
-                    results.append({
-                        "title": item.get('title', 'No Title'),
-                        "link": item.get('link', '#'),
-                        "snippet": item.get('snippet', 'No description available.')
-                    })
-                print(f"ShoppingAgent: Successfully retrieved {len(results)} results from Google.")
-            else:
-                print(f"ShoppingAgent: No items found in Google Search response for query: '{query}'")
-
+            results = await self.scheduler.search(
+                query,
+                lambda: self._search_google(query),
+                priority=priority
+            )
         except httpx.HTTPStatusError as e:
             print(f"ShoppingAgent: HTTP error occurred during Google Search: {e.response.status_code} - {e.response.text}")
+            results = []
         except httpx.RequestError as e:
              print(f"ShoppingAgent: Network error occurred during Google Search: {e}")
+             results = []
         except json.JSONDecodeError:
             print(f"ShoppingAgent: Failed to decode JSON response from Google Search.")
+            results = []
         except Exception as e:
             print(f"ShoppingAgent: An unexpected error occurred during Google Search: {e}")
             import traceback
             traceback.print_exc()
+            results = []
+
+        if offer_index and results:
+            # Adding may flush a segment to disk
+            await asyncio.to_thread(offer_index.add, results)
+
+        # --- Rank candidates locally against the specification ---
+        from shopping_ranker import rank_options
+        ranked = rank_options(results, specification)
+        if ranked:
+            print(f"ShoppingAgent: Ranked {len(results)} candidates, top result: '{ranked[0]['title']}'")
+        return ranked
+
+    async def _search_google(self, query: str) -> List[Dict[str, str]]:
+        """
+        Calls the Google Custom Search JSON API for a single query.
+
+        Raises:
+            QuotaExceededError: If Google reports the daily quota as exceeded
+            httpx.HTTPError: For other HTTP or network failures
+        """
+        # --- Prepare API Request --- 
+        params = {
+            'key': self.search_api_key,
+            'cx': self.search_engine_id,
+            'q': query,
+            'num': 10 # Maximum page size; results are re-ranked locally, so fetch as many candidates as one call allows
+        }
+
+        # --- Call Google Custom Search API using httpx --- 
+        results = []
+        async with httpx.AsyncClient() as client:
+            response = await client.get(self.base_url, params=params)
+            if response.status_code in (403, 429) and _is_daily_quota_error(response):
+                print(f"ShoppingAgent: Google Search daily quota exceeded: {response.status_code}")
+                raise QuotaExceededError(response.text)
+            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+            search_data = response.json()
+
+        # --- Parse Results --- 
+        if search_data and 'items' in search_data:
+            for item in search_data['items']:
+                results.append({
+                    "title": item.get('title', 'No Title'),
+                    "link": item.get('link', '#'),
+                    "snippet": item.get('snippet', 'No description available.')
+                })
+            print(f"ShoppingAgent: Successfully retrieved {len(results)} results from Google.")
+        else:
+            print(f"ShoppingAgent: No items found in Google Search response for query: '{query}'")
+
+        return results
+
 
-        return results 
\ No newline at end of file
+def _is_daily_quota_error(response: httpx.Response) -> bool:
+    """Checks whether a 403/429 response from Google means the daily quota is used up."""
+    try:
+        error = response.json().get("error", {})
+    except (ValueError, AttributeError):
+        return False
+    reasons = [err.get("reason") for err in error.get("errors", [])]
+    if any(reason in ("dailyLimitExceeded", "quotaExceeded") for reason in reasons):
+        return True
+    # Newer responses only carry the quota metric in the message
+    return "per day" in str(error.get("message", "")).lower()
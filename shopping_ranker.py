@@ -0,0 +1,192 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+PRICE_PATTERN = re.compile(r"(?:[$€£]\s?(\d[\d,]*(?:\.\d+)?))|(?:(\d[\d,]*(?:\.\d+)?)\s?(?:usd|eur|gbp|dollars?))", re.IGNORECASE)
+
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "for", "with", "in", "on", "to", "or", "by", "at", "from",
+    "buy", "shop", "online", "best", "new", "sale", "price", "prices", "free", "shipping",
+}
+
+# Known retail domains get a boost; reference/social sites are unlikely to be purchase options
+RETAIL_DOMAINS = {
+    "amazon.com", "amazon.co.uk", "amazon.de", "walmart.com", "ebay.com", "target.com",
+    "bestbuy.com", "homedepot.com", "lowes.com", "costco.com", "etsy.com", "wayfair.com",
+    "newegg.com", "bhphotovideo.com", "apple.com", "staples.com", "officedepot.com",
+    "grainger.com", "uline.com", "tractorsupply.com", "naturehills.com", "fast-growing-trees.com",
+}
+NON_RETAIL_DOMAINS = {
+    "wikipedia.org", "youtube.com", "reddit.com", "pinterest.com", "facebook.com",
+    "instagram.com", "quora.com", "twitter.com", "x.com", "tiktok.com",
+}
+RETAIL_BOOST = 1.25
+NON_RETAIL_PENALTY = 0.5
+PRICE_MATCH_BOOST = 1.15
+
+# Field weights for the query built from the specification
+NAME_WEIGHT = 3.0
+FEATURE_WEIGHT = 1.5
+CATEGORY_WEIGHT = 1.0
+
+# BM25 parameters; title tokens count double since titles are the most precise field
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_REPEAT = 2
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase word tokens without stopwords."""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def domain_of(link: str) -> str:
+    host = urlsplit(link or "").netloc.lower().split(":")[0]
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_link(link: str) -> str:
+    """Canonical form of a result URL for duplicate detection (no scheme, www, query or fragment)."""
+    parts = urlsplit(link or "")
+    return f"{domain_of(link)}{parts.path.rstrip('/').lower()}"
+
+
+def _matches_domain(domain: str, known: set) -> bool:
+    return any(domain == d or domain.endswith("." + d) for d in known)
+
+
+def _parse_price_range(estimated_price: Any) -> Optional[Tuple[float, float]]:
+    """Turn an estimatedPrice value like "$999-$1099" or "around 40 USD" into a (low, high) range."""
+    if estimated_price is None:
+        return None
+    numbers = [float(n.replace(",", "")) for n in re.findall(r"\d[\d,]*(?:\.\d+)?", str(estimated_price))]
+    if not numbers:
+        return None
+    low, high = min(numbers), max(numbers)
+    # Give single prices and tight ranges some slack
+    return low * 0.8, high * 1.2
+
+
+def _prices_in(text: str) -> List[float]:
+    prices = []
+    for match in PRICE_PATTERN.finditer(text or ""):
+        value = match.group(1) or match.group(2)
+        try:
+            prices.append(float(value.replace(",", "")))
+        except ValueError:
+            continue
+    return prices
+
+
+def build_query_weights(specification: Dict[str, Any]) -> Dict[str, float]:
+    """Weighted query terms from the specification's name, features and category."""
+    weights: Dict[str, float] = {}
+
+    def add(text: Any, weight: float) -> None:
+        for token in tokenize(str(text) if text is not None else None):
+            weights[token] = max(weights.get(token, 0.0), weight)
+
+    add(specification.get("category"), CATEGORY_WEIGHT)
+    for feature in specification.get("features") or []:
+        add(feature, FEATURE_WEIGHT)
+    add(specification.get("name"), NAME_WEIGHT)
+    return weights
+
+
+def bm25_scores(documents: List[List[str]], query_weights: Dict[str, float]) -> np.ndarray:
+    """
+    Score tokenized documents against weighted query terms with BM25.
+
+    The term-frequency matrix is restricted to query terms, so its size is
+    documents x query terms rather than documents x vocabulary.
+    """
+    if not documents or not query_weights:
+        return np.zeros(len(documents))
+
+    terms = list(query_weights)
+    term_index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(documents), len(terms)))
+    for row, tokens in enumerate(documents):
+        for token in tokens:
+            column = term_index.get(token)
+            if column is not None:
+                tf[row, column] += 1
+
+    doc_lengths = np.array([len(tokens) for tokens in documents], dtype=float)
+    avg_length = doc_lengths.mean() or 1.0
+    doc_freq = (tf > 0).sum(axis=0)
+    n_docs = len(documents)
+    idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_length)
+    saturated = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    weights = np.array([query_weights[term] for term in terms])
+    return saturated @ (idf * weights)
+
+
+def rank_options(options: List[Dict[str, str]], specification: Dict[str, Any],
+                 limit: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Re-rank shopping options against a product specification.
+
+    Options are scored with BM25 over title and snippet, boosted for known retail
+    domains and snippet prices within the estimated price range, and de-duplicated
+    by canonical URL and by identical titles on the same domain. Google's original
+    order is used as a tie-breaker.
+
+    Args:
+        options: Search results with `title`, `link` and `snippet`
+        specification: The finalized product specification
+        limit: Maximum number of options to return
+
+    Returns:
+        The options, best match first
+    """
+    if not options:
+        return []
+
+    query_weights = build_query_weights(specification or {})
+    documents = [
+        tokenize(option.get("title")) * TITLE_REPEAT + tokenize(option.get("snippet"))
+        for option in options
+    ]
+    scores = bm25_scores(documents, query_weights)
+
+    price_range = _parse_price_range((specification or {}).get("estimatedPrice"))
+    multipliers = np.ones(len(options))
+    for i, option in enumerate(options):
+        domain = domain_of(option.get("link", ""))
+        if _matches_domain(domain, RETAIL_DOMAINS):
+            multipliers[i] *= RETAIL_BOOST
+        elif _matches_domain(domain, NON_RETAIL_DOMAINS):
+            multipliers[i] *= NON_RETAIL_PENALTY
+        if price_range:
+            low, high = price_range
+            prices = _prices_in(f"{option.get('title', '')} {option.get('snippet', '')}")
+            if any(low <= price <= high for price in prices):
+                multipliers[i] *= PRICE_MATCH_BOOST
+
+    # Small prior on Google's order so equal scores keep the upstream ranking
+    prior = 1e-3 * (len(options) - np.arange(len(options))) / len(options)
+    final = (scores + prior) * multipliers
+
+    ranked = []
+    seen_links = set()
+    seen_titles = set()
+    for i in np.argsort(-final, kind="stable"):
+        option = options[i]
+        link_key = normalize_link(option.get("link", ""))
+        title_key = (domain_of(option.get("link", "")), " ".join(tokenize(option.get("title"))))
+        if link_key in seen_links or title_key in seen_titles:
+            continue
+        seen_links.add(link_key)
+        seen_titles.add(title_key)
+        ranked.append(option)
+        if limit and len(ranked) >= limit:
+            break
+    return ranked
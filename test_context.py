@@ -1,7 +1,10 @@
 import asyncio
+from dotenv import load_dotenv
 from ai_agent_service import ProcurementAgent
 import json
 
+load_dotenv()
+
 async def main():
     print("Starting context test...")
     agent = ProcurementAgent()
@@ -9,7 +12,7 @@ async def main():
     # First message
     print("\n--- SENDING FIRST MESSAGE ---")
     first_message = "Hi, my name is Boris and I'm looking for a Pyrus calleryana."
-    result1 = agent.process_message(first_message)
+    result1 = await agent.process_message(first_message)
     
     print(f"\nResponse: {result1['message'][:100]}...")
     print(f"History length: {len(result1['history'])}")
@@ -19,7 +22,7 @@ async def main():
     second_message = "Can you tell me what my name is and what product I'm looking for?"
     
     # Use history from previous response
-    result2 = agent.process_message(second_message, result1['history'])
+    result2 = await agent.process_message(second_message, result1['history'])
     
     print(f"\nResponse: {result2['message'][:100]}...")
     print(f"History length: {len(result2['history'])}")
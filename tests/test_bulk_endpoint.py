@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["OFFER_INDEX_PATH"] = ""
+os.environ["ADMIN_API_TOKEN"] = "admin-token"
+
+import server  # noqa: E402
+from admission import AdmissionController  # noqa: E402
+from ai_agent_service import ProcurementAgent  # noqa: E402
+from bulk_procurement import BulkItem, BulkProcurementRunner  # noqa: E402
+
+
+class FakeAgent:
+    async def process_message(self, user_message, history=None, force_finalize=False, finalized_items=None):
+        specification = {"name": user_message, "features": []}
+        return {"success": True, "message": "ok", "specifications": [specification],
+                "specification": specification, "history": [], "usage": None}
+
+
+class FakeShoppingAgent:
+    async def find_options(self, specification, priority=0):
+        return [{"title": specification["name"], "link": "https://example.com", "snippet": ""}]
+
+
+async def _items(*descriptions):
+    for number, description in enumerate(descriptions, start=1):
+        yield BulkItem(str(number), description)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(ProcurementAgent, "process_message", FakeAgent.process_message)
+    with TestClient(server.app, headers={"Authorization": "Bearer admin-token"}) as test_client:
+        monkeypatch.setattr(server.shopping_agent, "find_options", FakeShoppingAgent().find_options)
+        yield test_client
+
+
+def _results(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+def test_bulk_csv_upload(client):
+    body = "id,description\n1,Pyrus calleryana 90-120cm\n2,\"Compost, 5 pallets\"\n"
+    response = client.post("/api/bulk/specifications", content=body, headers={"Content-Type": "text/csv"}, timeout=10)
+    results = _results(response)
+    assert sorted(r["id"] for r in results) == ["1", "2"]
+    assert all(r["status"] == "ok" and r["shopping_options"] for r in results)
+
+
+def test_bulk_jsonl_upload(client):
+    body = "".join(json.dumps({"id": str(i), "description": f"item {i}"}) + "\n" for i in range(20))
+    response = client.post("/api/bulk/specifications?format=jsonl", content=body, timeout=10)
+    results = _results(response)
+    assert sorted(int(r["id"]) for r in results) == list(range(20))
+    assert all(r["status"] == "ok" for r in results)
+
+
+def test_bulk_upload_requires_the_admin_token(client):
+    body = "id,description\n1,Compost\n"
+    for authorization in ("", "Bearer wrong-token"):
+        response = client.post("/api/bulk/specifications", content=body,
+                               headers={"Content-Type": "text/csv", "Authorization": authorization})
+        assert response.status_code == 401
+
+
+def test_bulk_upload_stops_after_the_item_limit(client, monkeypatch):
+    monkeypatch.setattr(server, "BULK_MAX_ITEMS", 3)
+    body = "".join(json.dumps(f"item {i}") + "\n" for i in range(10))
+    results = _results(client.post("/api/bulk/specifications?format=jsonl", content=body, timeout=10))
+    assert len(results) == 4
+    assert sum(r["status"] == "ok" for r in results) == 3
+    assert [r["error"] for r in results if r["status"] == "error"] == [
+        "Upload exceeds the limit of 3 items; the remaining items were not processed"
+    ]
+
+
+def test_bulk_items_take_admission_slots(client):
+    admitted = server.admission_controller.counters.snapshot()["admitted"]
+    body = "".join(json.dumps({"id": str(i), "description": f"item {i}"}) + "\n" for i in range(3))
+    _results(client.post("/api/bulk/specifications?format=jsonl", content=body, timeout=10))
+    snapshot = server.admission_controller.snapshot()
+    assert snapshot["counters"]["admitted"] == admitted + 3
+    assert snapshot["in_flight"] == 0
+
+
+def test_bulk_items_wait_for_capacity_without_queueing():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_queue=4)
+        runner = BulkProcurementRunner(FakeShoppingAgent(), agent_factory=FakeAgent, admission=controller)
+        await controller.acquire("chat:busy")
+        asyncio.get_event_loop().call_later(0.2, controller._release, "chat:busy")
+        results = [result async for result in runner.run(_items("a", "b"))]
+        return controller, results
+
+    controller, results = asyncio.run(run())
+    assert [r["status"] for r in results] == ["ok", "ok"]
+    counters = controller.counters.snapshot()
+    assert counters["queued"] == 0 and counters["rejected_no_capacity"] >= 1
+    assert counters["admitted"] == 3
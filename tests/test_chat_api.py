@@ -0,0 +1,60 @@
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["OFFER_INDEX_PATH"] = ""
+
+import server  # noqa: E402
+from ai_agent_service import ProcurementAgent  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def process_message(self, user_message, history=None, force_finalize=False, finalized_items=None):
+        return {"success": True, "message": "ok", "specifications": [], "specification": None,
+                "history": list(history or []), "usage": None}
+
+    monkeypatch.setattr(ProcurementAgent, "process_message", process_message)
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+def test_new_conversations_get_their_own_admission_key(client, monkeypatch):
+    keys = []
+    admit = server.admission_controller.admit
+
+    @asynccontextmanager
+    async def recording_admit(key):
+        keys.append(key)
+        async with admit(key):
+            yield
+
+    monkeypatch.setattr(server.admission_controller, "admit", recording_admit)
+
+    first = client.post("/api/chat", json={"message": "I need a wheelbarrow"}).json()
+    second = client.post("/api/chat", json={"message": "I need compost"}).json()
+    follow_up = client.post("/api/chat", json={"message": "that's all", "conversation_id": first["conversation_id"]}).json()
+
+    assert first["conversation_id"] != second["conversation_id"]
+    assert follow_up["conversation_id"] == first["conversation_id"]
+    assert keys == [f"chat:{first['conversation_id']}", f"chat:{second['conversation_id']}", f"chat:{first['conversation_id']}"]
+
+
+def test_responses_follow_the_documented_models(client):
+    cached = [
+        {"role": "user", "content": "I need a wheelbarrow", "timestamp": "2026-10-19T10:00:00", "id": 7},
+        {"role": "assistant", "content": {"not": "text"}},
+    ]
+    chat = client.post("/api/chat", json={"message": "steel, 100 l", "cached_messages": cached}).json()
+    assert set(chat) == {"conversation_id", "response", "productSpecification", "isSpecificationFinalized",
+                         "messages", "shoppingOptions", "lineItems", "usage"}
+    assert chat["messages"][0] == {"role": "user", "content": "I need a wheelbarrow", "timestamp": "2026-10-19T10:00:00"}
+    assert all(isinstance(m["content"], str) for m in chat["messages"])
+
+    conversation = client.get(f"/api/conversations/{chat['conversation_id']}").json()
+    assert conversation == {"conversation_id": chat["conversation_id"], "messages": chat["messages"]}
@@ -0,0 +1,46 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_export import iter_export_rows, stream_export  # noqa: E402
+
+CONVERSATIONS = {
+    "c1": {
+        "messages": [
+            {"role": "user", "content": "I need a wheelbarrow", "timestamp": "2026-10-19T10:00:00"},
+            {"role": "assistant", "content": "Steel or plastic?", "timestamp": "2026-10-19T10:00:01"},
+        ],
+        "specifications": [{
+            "specification": {"name": "Wheelbarrow", "features": ["Steel", "100 l"], "estimatedPrice": "$80-$120", "category": "Garden"},
+            "shopping_options": [{"title": "Steel wheelbarrow", "link": "https://example.com/w", "snippet": ""}],
+            "finalized_at": "2026-10-19T10:05:00",
+        }],
+        "updated_at": "2026-10-19T10:05:00",
+    },
+}
+
+
+def test_ndjson_export_respects_since():
+    rows = [json.loads(line) for chunk in stream_export(iter_export_rows(CONVERSATIONS, until="2026-10-19T11:00:00"), "ndjson")
+            for line in chunk.splitlines()]
+    assert [r["record_type"] for r in rows] == ["message", "message", "specification", "shopping_option"]
+    assert rows[2]["spec_features"] == ["Steel", "100 l"]
+
+    later = list(iter_export_rows(CONVERSATIONS, since="2026-10-19T10:00:01", until="2026-10-19T11:00:00"))
+    assert [r["record_type"] for r in later] == ["specification", "shopping_option"]
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+def test_columnar_exports(format):
+    ipc = pytest.importorskip("pyarrow.ipc")
+    parquet = pytest.importorskip("pyarrow.parquet")
+
+    body = b"".join(stream_export(iter_export_rows(CONVERSATIONS, until="2026-10-19T11:00:00"), format, batch_size=2))
+    table = ipc.open_stream(io.BytesIO(body)).read_all() if format == "arrow" else parquet.read_table(io.BytesIO(body))
+    assert table.num_rows == 4
+    assert table.column("option_rank").to_pylist() == [None, None, None, 1]
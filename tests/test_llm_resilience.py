@@ -0,0 +1,41 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_resilience import CircuitBreaker, ResilientCaller  # noqa: E402
+
+
+def _half_open_caller() -> ResilientCaller:
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.0)
+    breaker.record_failure()
+    return ResilientCaller("test", timeout=5, max_attempts=1, hedging=False, breaker=breaker)
+
+
+def test_cancelled_trial_releases_half_open_circuit():
+    caller = _half_open_caller()
+
+    async def scenario():
+        trial = asyncio.ensure_future(caller.call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert caller.breaker.state == "half_open"
+        return await caller.call(lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(scenario()) == "ok"
+    assert caller.breaker.state == "closed"
+
+
+def test_stale_trial_expires_after_recovery_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    breaker._opened_at -= 1
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker._trial_started -= 1
+    assert breaker.allow()
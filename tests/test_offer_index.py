@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import offer_index  # noqa: E402
+from offer_index import OfferIndex  # noqa: E402
+from shopping_agent import ShoppingAgent  # noqa: E402
+
+SPECIFICATION = {"name": "Pyrus calleryana", "features": ["90-120cm"]}
+
+
+def _offers(count):
+    return [{"title": f"Pyrus calleryana tree {i}", "link": f"https://nursery.example/pyrus-{i}",
+             "snippet": "Pyrus calleryana 90-120cm, bare root"} for i in range(count)]
+
+
+def test_offers_stay_searchable_while_a_flush_writes_them(tmp_path, monkeypatch):
+    index = OfferIndex(str(tmp_path), flush_threshold=1000)
+    index.add(_offers(5))
+    writing, release = threading.Event(), threading.Event()
+    write = offer_index._Segment.write
+
+    def slow_write(path, offers, vectors=None):
+        writing.set()
+        release.wait(5)
+        write(path, offers, vectors)
+
+    monkeypatch.setattr(offer_index._Segment, "write", staticmethod(slow_write))
+    flush = threading.Thread(target=index.flush)
+    flush.start()
+    assert writing.wait(5)
+    # The lock is not held during the write, so lookups answer from the buffer being flushed
+    assert len(index.lookup(SPECIFICATION)) == 5
+    index.add(_offers(7)[5:])
+    release.set()
+    flush.join()
+
+    assert index.snapshot()["segments"] == 1 and index.snapshot()["buffered"] == 2
+    index.close()
+    reopened = OfferIndex(str(tmp_path))
+    assert reopened.size == 7
+
+
+def test_a_failed_flush_keeps_the_offers_buffered(tmp_path, monkeypatch):
+    index = OfferIndex(str(tmp_path), flush_threshold=1000)
+    index.add(_offers(3))
+
+    def failing_write(path, offers, vectors=None):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(offer_index._Segment, "write", staticmethod(failing_write))
+    with pytest.raises(OSError):
+        index.flush()
+    assert index.snapshot()["buffered"] == 3 and index.size == 3
+
+
+def test_shopping_agent_loads_the_index_once_off_the_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("OFFER_INDEX_PATH", str(tmp_path))
+    agent = ShoppingAgent()
+    loaded_in = []
+    open_offer_index = agent._open_offer_index
+
+    def record_thread():
+        loaded_in.append(threading.get_ident())
+        return open_offer_index()
+
+    monkeypatch.setattr(agent, "_open_offer_index", record_thread)
+
+    async def load_twice():
+        return await asyncio.gather(agent.load_offer_index(), agent.load_offer_index()), threading.get_ident()
+
+    assert agent.offer_index is None
+    (first, second), loop_thread = asyncio.run(load_twice())
+    assert first is second is agent.offer_index
+    assert len(loaded_in) == 1 and loaded_in[0] != loop_thread
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_agent_service import ProcurementAgent  # noqa: E402
+from prompt_assembly import TokenUsage  # noqa: E402
+
+
+def test_concurrent_turns_keep_their_own_history(monkeypatch):
+    agent = ProcurementAgent()
+    finished = []
+
+    async def complete(messages):
+        user_message = messages[-1]["content"]
+        # A's call is slower, so B's turn completes while A's is still waiting
+        await asyncio.sleep(0.2 if user_message.startswith("A") else 0.05)
+        finished.append(user_message)
+        return f"reply to {user_message}", TokenUsage()
+
+    monkeypatch.setattr(agent.agent, "complete", complete)
+    history_a = [{"role": "system", "content": "s"}, {"role": "user", "content": "A-earlier"}, {"role": "assistant", "content": "ok"}]
+    history_b = [{"role": "system", "content": "s"}, {"role": "user", "content": "B-earlier"}, {"role": "assistant", "content": "ok"}]
+
+    async def run_both():
+        return await asyncio.gather(agent.process_message("A-new", history_a), agent.process_message("B-new", history_b))
+
+    result_a, result_b = asyncio.run(run_both())
+
+    assert [m["content"] for m in result_a["history"]] == ["s", "A-earlier", "ok", "A-new", "reply to A-new"]
+    assert [m["content"] for m in result_b["history"]] == ["s", "B-earlier", "ok", "B-new", "reply to B-new"]
+    assert finished == ["B-new", "A-new"]
+    # The stored histories are not modified in place
+    assert len(history_a) == 3 and len(history_b) == 3
+
+
+def test_turn_after_a_named_product_mentions_it_in_the_instructions(monkeypatch):
+    agent = ProcurementAgent()
+    sent = []
+
+    async def complete(messages):
+        sent.append(messages)
+        return "What height do you need?", TokenUsage()
+
+    monkeypatch.setattr(agent.agent, "complete", complete)
+    history = [
+        {"role": "system", "content": "s"},
+        {"role": "user", "content": "Hi, I want to buy Pyrus calleryana for my garden."},
+        {"role": "assistant", "content": "Great choice! How many trees do you need?"},
+    ]
+
+    result = asyncio.run(agent.process_message("Five trees, please", history))
+
+    assert result["success"], result["message"]
+    assert any("Product: Pyrus" in m["content"] for m in sent[0])
+    assert [m["content"] for m in result["history"]][-2:] == ["Five trees, please", "What height do you need?"]
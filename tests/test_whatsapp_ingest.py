@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whatsapp_ingest import has_messages, verify_signature  # noqa: E402
+
+APP_SECRET = "app-secret"
+
+
+def _signature(body: bytes, secret: str = APP_SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _webhook_body(value) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": value}]}],
+    }).encode()
+
+
+STATUS_BODY = _webhook_body({
+    "messaging_product": "whatsapp",
+    "metadata": {"display_phone_number": "15550000000", "phone_number_id": "1"},
+    "statuses": [{"id": "wamid.1", "status": "delivered", "timestamp": "1700000000", "recipient_id": "15551234567"}],
+})
+
+
+def _message_body(text: str) -> bytes:
+    return _webhook_body({
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": "1"},
+        "contacts": [{"profile": {"name": "Sam"}, "wa_id": "15551234567"}],
+        "messages": [{"from": "15551234567", "id": "wamid.2", "timestamp": "1700000000",
+                      "type": "text", "text": {"body": text}}],
+    })
+
+
+def test_valid_signature_is_accepted():
+    body = _message_body("hello")
+    assert verify_signature(body, _signature(body), APP_SECRET)
+    # Meta sends lowercase hex, but the comparison does not depend on case or trailing space
+    assert verify_signature(body, _signature(body).upper().replace("SHA256=", "sha256=") + " ", APP_SECRET)
+
+
+def test_missing_signature_is_rejected():
+    body = _message_body("hello")
+    assert not verify_signature(body, None, APP_SECRET)
+    assert not verify_signature(body, "", APP_SECRET)
+
+
+def test_signature_without_the_sha256_prefix_is_rejected():
+    body = _message_body("hello")
+    digest = _signature(body)[len("sha256="):]
+    assert not verify_signature(body, digest, APP_SECRET)
+    assert not verify_signature(body, "sha1=" + digest, APP_SECRET)
+
+
+def test_tampered_body_or_wrong_secret_is_rejected():
+    body = _message_body("hello")
+    signature = _signature(body)
+    assert not verify_signature(_message_body("hellO"), signature, APP_SECRET)
+    # Re-serializing the same JSON changes the bytes, so the signature no longer matches
+    assert not verify_signature(json.dumps(json.loads(body), indent=1).encode(), signature, APP_SECRET)
+    assert not verify_signature(body, _signature(body, "other-secret"), APP_SECRET)
+
+
+def test_status_only_body_has_no_messages():
+    # "messages" appears as the value of "field", which must not count as a messages key
+    assert b'"field": "messages"' in STATUS_BODY
+    assert not has_messages(STATUS_BODY)
+
+
+def test_message_bodies_have_messages():
+    assert has_messages(_message_body("hello"))
+    assert has_messages(_message_body('my order: {"messages": [1, 2]}'))
+    assert has_messages(json.dumps(json.loads(_message_body("compact")), separators=(",", ":")).encode())
+
+
+def test_status_body_quoting_messages_key_in_a_value_is_not_a_message():
+    # Text inside JSON strings is escaped, so a quoted `"messages":` is not a key
+    body = _webhook_body({"statuses": [{"id": "wamid.1", "status": "failed",
+                                        "errors": [{"title": 'bad "messages": value'}]}]})
+    assert not has_messages(body)
@@ -0,0 +1,40 @@
+import hashlib
+import hmac
+import re
+from typing import Optional
+
+from metrics import Counters
+
+# A "messages" *key* only occurs in payloads that carry user messages. Status callbacks
+# (sent/delivered/read) also contain the string "messages", but only as the value of
+# `"field": "messages"`, which is never followed by a colon.
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+
+SIGNATURE_PREFIX = "sha256="
+
+# Reported under "webhook" in /api/metrics
+webhook_counters = Counters("received", "status_only", "messages", "invalid_signature", "invalid_payload")
+
+
+def verify_signature(raw_body: bytes, signature_header: Optional[str], app_secret: str) -> bool:
+    """
+    Check the `x-hub-signature-256` header Meta sends with every webhook call.
+
+    The header is `sha256=` followed by the hex HMAC-SHA256 of the raw request body,
+    keyed with the app secret. It must be computed on the exact bytes received.
+    """
+    if not signature_header or not signature_header.startswith(SIGNATURE_PREFIX):
+        return False
+    expected = hmac.new(app_secret.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len(SIGNATURE_PREFIX):].strip().lower())
+
+
+def has_messages(raw_body: bytes) -> bool:
+    """
+    Cheap scan of the raw body: False means the payload carries no user messages (e.g. a
+    status-only callback) and can be acknowledged without parsing it into models.
+
+    False positives are harmless (the payload is then parsed in full); there are no false
+    negatives for well-formed payloads.
+    """
+    return _MESSAGES_KEY.search(raw_body) is not None